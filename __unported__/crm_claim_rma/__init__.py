@@ -24,3 +24,7 @@ from . import wizard
 from . import crm_claim_rma
 from . import account_invoice
 from . import stock
+from . import product
+from . import ir_property
+from . import res_partner
+from . import ir_sequence
@@ -41,6 +41,8 @@ It mainly contains the following features:
 * warranty control & return address (based on invoice date and product form)
 * product picking in / out
 * product refund
+* import of the claim lines from CSV or XLSX files (the XLSX files need the
+  openpyxl Python library)
 * access to related customer data (orders, invoices, refunds, picking
   in/out) from a claim
 * use the OpenERP chatter within team like in opportunity (reply to refer to
@@ -77,10 +79,13 @@ Contributors:
                 'product_warranty',
                 ],
     'data': ['wizard/claim_make_picking_view.xml',
+             'wizard/claim_mass_refund_view.xml',
+             'wizard/claim_line_import_view.xml',
              'crm_claim_rma_view.xml',
              'security/ir.model.access.csv',
              'account_invoice_view.xml',
              'stock_view.xml',
+             'ir_sequence_view.xml',
              'res_partner_view.xml',
              'crm_claim_rma_data.xml',
              ],
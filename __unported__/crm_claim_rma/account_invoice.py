@@ -32,12 +32,31 @@ class account_invoice(orm.Model):
         'claim_id': fields.many2one('crm.claim', 'Claim'),
     }
 
+    def _refund_line_fields(self, cr, uid, context=None):
+        """ Return the fields of the invoice lines copied on the refund
+        lines and the ones copied as many2many commands.
+
+        The result only depends on the model, it is computed once.
+        """
+        fields_ = getattr(self, '_refund_line_fields_cache', None)
+        if fields_ is None:
+            inv_line_obj = self.pool.get('account.invoice.line')
+            copied = []
+            many2many = []
+            for field_name, field in inv_line_obj._all_columns.iteritems():
+                column_type = field.column._type
+                if column_type not in ('many2many', 'one2many'):
+                    copied.append(field_name)
+                elif field_name == 'invoice_line_tax_id':
+                    many2many.append(field_name)
+            fields_ = self._refund_line_fields_cache = (copied, many2many)
+        return fields_
+
     def _refund_cleanup_lines(self, cr, uid, lines, context=None):
         """ Override when from claim to update the quantity and link to the
         claim line."""
         if context is None:
             context = {}
-        new_lines = []
         inv_line_obj = self.pool.get('account.invoice.line')
         claim_line_obj = self.pool.get('claim.line')
         # check if is an invoice_line and we are from a claim
@@ -46,29 +65,35 @@ class account_invoice(orm.Model):
             return super(account_invoice, self)._refund_cleanup_lines(
                 cr, uid, lines, context=None)
 
-        for __, claim_line_id, __ in context.get('claim_line_ids'):
-            line = claim_line_obj.browse(cr, uid, claim_line_id,
-                                         context=context)
-            if not line.refund_line_id:
-                # For each lines replace quantity and add claim_line_id
-                inv_line = inv_line_obj.browse(cr, uid,
-                                               line.invoice_line_id.id,
-                                               context=context)
-                clean_line = {}
-                for field_name, field in inv_line._all_columns.iteritems():
-                    column_type = field.column._type
-                    if column_type == 'many2one':
-                        clean_line[field_name] = inv_line[field_name].id
-                    elif column_type not in ('many2many', 'one2many'):
-                        clean_line[field_name] = inv_line[field_name]
-                    elif field_name == 'invoice_line_tax_id':
-                        tax_list = []
-                        for tax in inv_line[field_name]:
-                            tax_list.append(tax.id)
-                        clean_line[field_name] = [(6, 0, tax_list)]
-                clean_line['quantity'] = line['product_returned_quantity']
-                clean_line['claim_line_id'] = [claim_line_id]
-                new_lines.append(clean_line)
+        claim_line_ids = [claim_line_id for __, claim_line_id, __
+                          in context.get('claim_line_ids')]
+        claim_lines = claim_line_obj.read(
+            cr, uid, claim_line_ids,
+            ['refund_line_id', 'invoice_line_id', 'product_returned_quantity'],
+            context=context, load='_classic_write')
+        claim_lines = dict((line['id'], line) for line in claim_lines)
+        # For each lines replace quantity and add claim_line_id
+        claim_line_ids = [claim_line_id for claim_line_id in claim_line_ids
+                          if not claim_lines[claim_line_id]['refund_line_id']]
+        copied, many2many = self._refund_line_fields(cr, uid,
+                                                     context=context)
+        inv_line_ids = list(set(claim_lines[claim_line_id]['invoice_line_id']
+                                for claim_line_id in claim_line_ids))
+        inv_lines = inv_line_obj.read(cr, uid, inv_line_ids,
+                                      copied + many2many,
+                                      context=context, load='_classic_write')
+        inv_lines = dict((inv_line['id'], inv_line) for inv_line in inv_lines)
+        new_lines = []
+        for claim_line_id in claim_line_ids:
+            line = claim_lines[claim_line_id]
+            inv_line = inv_lines[line['invoice_line_id']]
+            clean_line = dict((field_name, inv_line[field_name])
+                              for field_name in copied)
+            for field_name in many2many:
+                clean_line[field_name] = [(6, 0, inv_line[field_name])]
+            clean_line['quantity'] = line['product_returned_quantity']
+            clean_line['claim_line_id'] = [claim_line_id]
+            new_lines.append(clean_line)
         if not new_lines:
             # TODO use custom states to show button of this wizard or
             # not instead of raise an error
@@ -77,6 +102,28 @@ class account_invoice(orm.Model):
                 _('A refund has already been created for this claim !'))
         return [(0, 0, l) for l in new_lines]
 
+    def refund(self, cr, uid, ids, date=None, period_id=None,
+               description=None, journal_id=None, context=None):
+        """ When refunding claim lines, the refund lines are linked to
+        the claim lines at the end, with a single update """
+        if context is None:
+            context = {}
+        if not context.get('claim_line_ids'):
+            return super(account_invoice, self).refund(
+                cr, uid, ids, date=date, period_id=period_id,
+                description=description, journal_id=journal_id,
+                context=context)
+        # filled by the creation of the invoice lines
+        links = []
+        ctx = dict(context, claim_refund_links=links)
+        result = super(account_invoice, self).refund(
+            cr, uid, ids, date=date, period_id=period_id,
+            description=description, journal_id=journal_id, context=ctx)
+        claim_line_obj = self.pool.get('claim.line')
+        claim_line_obj.write_many2one_values(cr, uid, 'refund_line_id',
+                                             links, context=context)
+        return result
+
     def _prepare_refund(self, cr, uid, invoice, date=None, period_id=None,
                         description=None, journal_id=None, context=None):
         if context is None:
@@ -102,8 +149,15 @@ class account_invoice_line(orm.Model):
         line_id = super(account_invoice_line, self).create(
             cr, uid, vals, context=context)
         if claim_line_id:
-            claim_line_obj = self.pool.get('claim.line')
-            claim_line_obj.write(cr, uid, claim_line_id,
-                                 {'refund_line_id': line_id},
-                                 context=context)
+            if isinstance(claim_line_id, (int, long)):
+                claim_line_id = [claim_line_id]
+            links = (context or {}).get('claim_refund_links')
+            if links is not None:
+                # linked by the refund once all the lines are created
+                links.extend((line, line_id) for line in claim_line_id)
+            else:
+                claim_line_obj = self.pool.get('claim.line')
+                claim_line_obj.write(cr, uid, claim_line_id,
+                                     {'refund_line_id': line_id},
+                                     context=context)
         return line_id
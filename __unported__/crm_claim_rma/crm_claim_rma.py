@@ -22,14 +22,18 @@
 ##############################################################################
 
 import calendar
+import logging
 import math
+from itertools import izip
 from openerp.osv import fields, orm, osv
-from datetime import datetime
+from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from openerp.tools import (DEFAULT_SERVER_DATE_FORMAT,
                            DEFAULT_SERVER_DATETIME_FORMAT)
 from openerp.tools.translate import _
-from openerp import SUPERUSER_ID
+from openerp import SUPERUSER_ID, tools
+
+_logger = logging.getLogger(__name__)
 
 
 class InvoiceNoDate(Exception):
@@ -70,9 +74,11 @@ class claim_line(orm.Model):
     # Method to calculate total amount of the line : qty*UP
     def _line_total_amount(self, cr, uid, ids, field_name, arg, context=None):
         res = {}
-        for line in self.browse(cr, uid, ids, context=context):
-            res[line.id] = (line.unit_sale_price *
-                            line.product_returned_quantity)
+        for line in self.read(cr, uid, ids,
+                              ['unit_sale_price', 'product_returned_quantity'],
+                              context=context):
+            res[line['id']] = (line['unit_sale_price'] *
+                               line['product_returned_quantity'])
         return res
 
     def copy_data(self, cr, uid, id, default=None, context=None):
@@ -125,6 +131,12 @@ class claim_line(orm.Model):
                  "discount, can be for 0 if product for free,..."),
         'return_value': fields.function(
             _line_total_amount, string='Total return', type='float',
+            store={
+                'claim.line': (lambda self, cr, uid, ids, c=None: ids,
+                               ['unit_sale_price',
+                                'product_returned_quantity'], 10),
+            },
+            select=True,
             help="Quantity returned * Unit sold price",),
         'prodlot_id': fields.many2one(
             'stock.production.lot',
@@ -227,6 +239,50 @@ class claim_line(orm.Model):
         days = int(days_month * decimal_part)
         return start + relativedelta(months=months, days=days)
 
+    @staticmethod
+    def warranty_limits(starts, warranty_durations):
+        """ Bulk version of :meth:`warranty_limit`
+
+        Take a list of start dates and a list of durations in float of the
+        same length and return the list of the limits.
+
+        The months and days to add depend only on the month of the start
+        date and on the duration, so they are computed once for each
+        (year, month, duration) combination.
+
+        """
+        shifts = {}
+        limits = []
+        for start, warranty_duration in izip(starts, warranty_durations):
+            key = (start.year, start.month, warranty_duration)
+            shift = shifts.get(key)
+            if shift is None:
+                decimal_part, months = math.modf(warranty_duration)
+                year, month = divmod(start.year * 12 + start.month - 1 +
+                                     int(months), 12)
+                month += 1
+                __, days_month = calendar.monthrange(year, month)
+                # ignore the rest of the days (hours) since we expect a date
+                days = int(days_month * decimal_part)
+                shift = shifts[key] = (year, month, days_month, days)
+            year, month, days_month, days = shift
+            # same as relativedelta: the day is kept in the limits of the
+            # month, then the days are added
+            limit = start.replace(year=year, month=month,
+                                  day=min(start.day, days_month))
+            limits.append(limit + timedelta(days=days))
+        return limits
+
+    def _warranty_duration(self, cr, uid, product, claim_type,
+                           context=None):
+        """ Return the warranty duration (in months) of a product """
+        if claim_type == 'supplier':
+            suppliers = product.seller_ids
+            if not suppliers:
+                raise ProductNoSupplier
+            return suppliers[0].warranty_duration
+        return product.warranty
+
     def _warranty_limit_values(self, cr, uid, ids, invoice,
                                claim_type, product, claim_date,
                                context=None):
@@ -235,17 +291,19 @@ class claim_line(orm.Model):
         date_invoice = invoice.date_invoice
         if not date_invoice:
             raise InvoiceNoDate
+        warranty_duration = self._warranty_duration(cr, uid, product,
+                                                    claim_type,
+                                                    context=context)
+        return self._warranty_limit_duration_values(
+            cr, uid, ids, date_invoice, warranty_duration, claim_date,
+            context=context)
+
+    def _warranty_limit_duration_values(self, cr, uid, ids, date_invoice,
+                                        warranty_duration, claim_date,
+                                        context=None):
         warning = _(self.WARRANT_COMMENT['not_define'])
         date_invoice = datetime.strptime(date_invoice,
                                          DEFAULT_SERVER_DATE_FORMAT)
-        if claim_type == 'supplier':
-            suppliers = product.seller_ids
-            if not suppliers:
-                raise ProductNoSupplier
-            supplier = suppliers[0]
-            warranty_duration = supplier.warranty_duration
-        else:
-            warranty_duration = product.warranty
         limit = self.warranty_limit(date_invoice, warranty_duration)
         if warranty_duration > 0:
             claim_date = datetime.strptime(claim_date,
@@ -257,36 +315,116 @@ class claim_line(orm.Model):
         return {'guarantee_limit': limit.strftime(DEFAULT_SERVER_DATE_FORMAT),
                 'warning': warning}
 
-    def set_warranty_limit(self, cr, uid, ids, claim_line, context=None):
-        claim = claim_line.claim_id
-        invoice = claim.invoice_id
-        claim_type = claim.claim_type
-        claim_date = claim.date
-        product = claim_line.product_id
-        try:
-            values = self._warranty_limit_values(cr, uid, ids, invoice,
-                                                 claim_type, product,
-                                                 claim_date,
-                                                 context=context)
-        except InvoiceNoDate:
-            raise orm.except_orm(
-                _('Error'),
-                _('Cannot find any date for invoice. '
-                  'Must be a validated invoice.'))
-        except ProductNoSupplier:
-                raise orm.except_orm(
-                    _('Error'),
-                    _('The product has no supplier configured.'))
-        self.write(cr, uid, ids, values, context=context)
-        return True
+    def _warrant_comments(self, cr, uid, context=None):
+        """ Return the warranty states translated in the language of the
+        context, or of the user when the context has none (the
+        administrator for the scheduled actions) """
+        comments = {}
+        # not in a generator expression, ``_`` reads the context and the
+        # user in the locals of its caller
+        for key, comment in self.WARRANT_COMMENT.iteritems():
+            comments[key] = _(comment)
+        return comments
+
+    def refresh_warranty_status(self, cr, uid, context=None):
+        """ Recompute the warranty limit and state of all the claim lines
+        not treated yet, in a single UPDATE.
+
+        Called by a scheduled action, so the warranty state does not stay
+        outdated on the open claims.  The limit is computed as in
+        :meth:`warranty_limit`: the integer part of the duration is added
+        as months, its decimal part as a fraction of the days of the
+        reached month.  The invoice is the one of the invoice line, then
+        the one of the claim, like in :meth:`set_warranty`.  The lines
+        whose warranty cannot be computed (no invoice date, no supplier
+        for a supplier claim) are left untouched.
+
+        Return the number of updated lines.
+
+        """
+        cr.execute("""
+            WITH seller AS (
+                SELECT DISTINCT ON (product_id)
+                       product_id, warranty_duration
+                FROM product_supplierinfo
+                ORDER BY product_id, sequence, id
+            ),
+            duration AS (
+                SELECT line.id,
+                       claim.date AS claim_date,
+                       inv.date_invoice,
+                       CASE WHEN claim.claim_type = 'supplier'
+                            THEN COALESCE(seller.warranty_duration, 0)
+                            ELSE COALESCE(tmpl.warranty, 0)
+                       END AS duration
+                FROM claim_line line
+                JOIN crm_claim claim ON claim.id = line.claim_id
+                LEFT JOIN account_invoice_line inv_line
+                       ON inv_line.id = line.invoice_line_id
+                -- the invoice of the line, then the one of the claim, as
+                -- in _get_warranty_values_batch
+                JOIN account_invoice inv
+                  ON inv.id = COALESCE(inv_line.invoice_id, claim.invoice_id)
+                JOIN product_product prod ON prod.id = line.product_id
+                JOIN product_template tmpl ON tmpl.id = prod.product_tmpl_id
+                LEFT JOIN seller ON seller.product_id = tmpl.id
+                WHERE COALESCE(line.state, 'draft') != 'treated'
+                AND line.invoice_line_id IS NOT NULL
+                AND inv.date_invoice IS NOT NULL
+                AND claim.date IS NOT NULL
+                AND claim.claim_type IS NOT NULL
+                AND (claim.claim_type != 'supplier'
+                     OR seller.product_id IS NOT NULL)
+            ),
+            month_day AS (
+                SELECT id, claim_date, duration,
+                       (date_invoice +
+                        interval '1 month' * trunc(duration)
+                        )::date AS month_day
+                FROM duration
+            ),
+            limits AS (
+                SELECT id, claim_date, duration,
+                       month_day + trunc(
+                           extract(day FROM date_trunc('month', month_day)
+                                   + interval '1 month' - interval '1 day')
+                           * (duration - trunc(duration)))::integer
+                       AS guarantee_limit
+                FROM month_day
+            ),
+            warranty AS (
+                SELECT id, guarantee_limit,
+                       CASE WHEN duration <= 0 THEN %(not_define)s
+                            WHEN guarantee_limit < claim_date
+                                THEN %(expired)s
+                            ELSE %(valid)s
+                       END AS warning
+                FROM limits
+            )
+            UPDATE claim_line
+            SET guarantee_limit = warranty.guarantee_limit,
+                warning = warranty.warning,
+                write_uid = %(uid)s,
+                write_date = (now() AT TIME ZONE 'UTC')
+            FROM warranty
+            WHERE claim_line.id = warranty.id
+            AND (claim_line.guarantee_limit, claim_line.warning)
+                IS DISTINCT FROM (warranty.guarantee_limit, warranty.warning)
+            """, dict(self._warrant_comments(cr, uid, context=context),
+                      uid=uid))
+        count = cr.rowcount
+        _logger.info('Warranty status refreshed on %d claim lines', count)
+        return count
 
     def auto_set_warranty(self, cr, uid, ids, context):
         """ Set warranty automatically
         if the user has not himself pressed on 'Calculate warranty state'
         button, it sets warranty for him"""
-        for line in self.browse(cr, uid, ids, context=context):
-            if not line.warning:
-                self.set_warranty(cr, uid, [line.id], context=context)
+        line_ids = [line.id for line
+                    in self.browse(cr, uid, ids, context=context)
+                    if not line.warning]
+        if line_ids:
+            self.set_warranty(cr, uid, line_ids, context=context)
         return True
 
     def get_destination_location(self, cr, uid, product_id,
@@ -294,14 +432,35 @@ class claim_line(orm.Model):
         """Compute and return the destination location ID to take
         for a return. Always take 'Supplier' one when return type different
         from company."""
-        prod = False
+        if context is None:
+            context = {}
+        company_id = context.get('force_company')
+        if not company_id:
+            user_obj = self.pool['res.users']
+            company_id = user_obj._get_company(cr, uid, context=context)
+        return self._resolve_destination_location(cr, uid, product_id,
+                                                  warehouse_id, company_id)
+
+    @tools.ormcache(skiparg=3)
+    def _resolve_destination_location(self, cr, uid, product_id,
+                                      warehouse_id, company_id):
+        """ Cached computation of the destination location of a return
+
+        The cache is cleared when a supplier info, the stock location of a
+        warehouse or a supplier location property is modified.
+
+        """
+        context = {'force_company': company_id}
+        location_dest_id = False
+        if warehouse_id:
+            wh_obj = self.pool.get('stock.warehouse')
+            wh = wh_obj.browse(cr, SUPERUSER_ID, warehouse_id,
+                               context=context)
+            location_dest_id = wh.lot_stock_id.id
         if product_id:
             prod_obj = self.pool.get('product.product')
-            prod = prod_obj.browse(cr, uid, product_id, context=context)
-        wh_obj = self.pool.get('stock.warehouse')
-        wh = wh_obj.browse(cr, uid, warehouse_id, context=context)
-        location_dest_id = wh.lot_stock_id.id
-        if prod:
+            prod = prod_obj.browse(cr, SUPERUSER_ID, product_id,
+                                   context=context)
             seller = prod.seller_info_id
             if seller:
                 return_type = seller.warranty_return_partner
@@ -309,6 +468,10 @@ class claim_line(orm.Model):
                     location_dest_id = seller.name.property_stock_supplier.id
         return location_dest_id
 
+    def clear_destination_location_cache(self, cr, uid, context=None):
+        self._resolve_destination_location.clear_cache(self)
+        return True
+
     def onchange_product_id(self, cr, uid, ids, product_id, invoice_line_id,
                             claim_id, company_id, warehouse_id,
                             claim_type, claim_date, context=None):
@@ -391,28 +554,238 @@ class claim_line(orm.Model):
                 'warranty_type': return_type,
                 'location_dest_id': location_dest_id}
 
-    def set_warranty_return_address(self, cr, uid, ids, claim_line,
-                                    context=None):
-        claim = claim_line.claim_id
-        product = claim_line.product_id
-        company = claim.company_id
-        warehouse = claim.warehouse_id
-        values = self._warranty_return_address_values(
-            cr, uid, ids, product, company, warehouse, context=context)
-        self.write(cr, uid, ids, values, context=context)
+    def _get_warranty_values_batch(self, cr, uid, ids, context=None):
+        """ Compute the warranty limit, state and return address of
+        several claim lines at once.
+
+        The claims, invoices, products, suppliers, companies and
+        warehouses of all the lines are read upfront, once per model, and
+        the values are then computed in memory.
+
+        Return a tuple ``(values, errors)`` where ``values`` is a dict
+        ``{line_id: values}`` and ``errors`` a dict ``{line_id: message}``
+        for the lines whose warranty cannot be computed.
+
+        """
+        def m2o_id(value):
+            if isinstance(value, (tuple, list)):
+                return value[0]
+            return value or False
+
+        def read_by_id(model, record_ids, field_names):
+            record_ids = list(set(record_ids) - set([False]))
+            if not record_ids:
+                return {}
+            records = self.pool[model].read(cr, uid, record_ids, field_names,
+                                            context=context)
+            return dict((record['id'], record) for record in records)
+
+        lines = self.read(cr, uid, ids,
+                          ['claim_id', 'product_id', 'invoice_line_id'],
+                          context=context)
+        claims = read_by_id(
+            'crm.claim',
+            [m2o_id(line['claim_id']) for line in lines],
+            ['invoice_id', 'claim_type', 'date', 'company_id',
+             'warehouse_id'])
+        # the invoice of the line, for instance found from its serial
+        # number, takes precedence over the invoice of the claim
+        invoice_lines = read_by_id(
+            'account.invoice.line',
+            [m2o_id(line['invoice_line_id']) for line in lines],
+            ['invoice_id'])
+        invoices = read_by_id(
+            'account.invoice',
+            [m2o_id(claim['invoice_id']) for claim in claims.itervalues()] +
+            [m2o_id(invoice_line['invoice_id'])
+             for invoice_line in invoice_lines.itervalues()],
+            ['date_invoice'])
+        companies = read_by_id(
+            'res.company',
+            [m2o_id(claim['company_id']) for claim in claims.itervalues()],
+            ['crm_return_address_id', 'partner_id'])
+        warehouses = read_by_id(
+            'stock.warehouse',
+            [m2o_id(claim['warehouse_id']) for claim in claims.itervalues()],
+            ['lot_stock_id'])
+        products = read_by_id(
+            'product.product',
+            [m2o_id(line['product_id']) for line in lines],
+            ['warranty', 'seller_ids', 'seller_info_id'])
+        seller_ids = []
+        for product in products.itervalues():
+            if product['seller_ids']:
+                seller_ids.append(product['seller_ids'][0])
+            seller_ids.append(m2o_id(product['seller_info_id']))
+        sellers = read_by_id(
+            'product.supplierinfo', seller_ids,
+            ['warranty_duration', 'warranty_return_partner',
+             'warranty_return_address', 'name'])
+        suppliers = read_by_id(
+            'res.partner',
+            [m2o_id(seller['name']) for seller in sellers.itervalues()
+             if seller['warranty_return_partner'] != 'company'],
+            ['property_stock_supplier'])
+
+        comments = self._warrant_comments(cr, uid, context=context)
+        result = {}
+        errors = {}
+        limit_lines = []
+        for line in lines:
+            line_id = line['id']
+            claim = claims.get(m2o_id(line['claim_id']), {})
+            product = products.get(m2o_id(line['product_id']))
+            if not (product and line['invoice_line_id']):
+                errors[line_id] = _('Please set product and invoice.')
+                continue
+            invoice_line = invoice_lines.get(m2o_id(line['invoice_line_id']),
+                                             {})
+            invoice = invoices.get(m2o_id(invoice_line.get('invoice_id')) or
+                                   m2o_id(claim.get('invoice_id')))
+            claim_type = claim.get('claim_type')
+            claim_date = claim.get('date')
+            values = {'guarantee_limit': False, 'warning': False}
+            if invoice and claim_type and claim_date:
+                if not invoice['date_invoice']:
+                    errors[line_id] = _('Cannot find any date for invoice. '
+                                        'Must be a validated invoice.')
+                    continue
+                if claim_type == 'supplier':
+                    if not product['seller_ids']:
+                        errors[line_id] = _('The product has no supplier '
+                                            'configured.')
+                        continue
+                    supplier = sellers[product['seller_ids'][0]]
+                    warranty_duration = supplier['warranty_duration']
+                else:
+                    warranty_duration = product['warranty']
+                # the limits are computed all at once at the end
+                limit_lines.append((line_id, invoice['date_invoice'],
+                                    warranty_duration, claim_date))
+
+            company = companies.get(m2o_id(claim.get('company_id')))
+            warehouse = warehouses.get(m2o_id(claim.get('warehouse_id')))
+            if not (company and warehouse):
+                values.update({'warranty_return_partner': False,
+                               'warranty_type': False,
+                               'location_dest_id': False})
+                result[line_id] = values
+                continue
+            location_dest_id = m2o_id(warehouse['lot_stock_id'])
+            seller = sellers.get(m2o_id(product['seller_info_id']))
+            if seller:
+                return_address_id = m2o_id(seller['warranty_return_address'])
+                return_type = seller['warranty_return_partner']
+                if return_type != 'company':
+                    supplier = suppliers[m2o_id(seller['name'])]
+                    location_dest_id = m2o_id(
+                        supplier['property_stock_supplier'])
+            else:
+                # when no supplier is configured, returns to the company
+                return_address_id = (m2o_id(company['crm_return_address_id'])
+                                     or m2o_id(company['partner_id']))
+                return_type = 'company'
+            values.update({'warranty_return_partner': return_address_id,
+                           'warranty_type': return_type,
+                           'location_dest_id': location_dest_id})
+            result[line_id] = values
+
+        if limit_lines:
+            line_ids, dates_invoice, durations, claim_dates = zip(*limit_lines)
+            limits = self.warranty_limits(
+                [datetime.strptime(date_invoice, DEFAULT_SERVER_DATE_FORMAT)
+                 for date_invoice in dates_invoice],
+                durations)
+            for line_id, limit, warranty_duration, claim_date in izip(
+                    line_ids, limits, durations, claim_dates):
+                warning = comments['not_define']
+                if warranty_duration > 0:
+                    claim_date = datetime.strptime(
+                        claim_date, DEFAULT_SERVER_DATETIME_FORMAT)
+                    if limit < claim_date:
+                        warning = comments['expired']
+                    else:
+                        warning = comments['valid']
+                result[line_id].update({
+                    'guarantee_limit': limit.strftime(
+                        DEFAULT_SERVER_DATE_FORMAT),
+                    'warning': warning,
+                })
+        return result, errors
+
+    def _write_grouped(self, cr, uid, values, context=None):
+        """ Write ``{line_id: values}``, with a single write for all the
+        lines sharing the same values """
+        groups = {}
+        for line_id, line_values in values.iteritems():
+            key = tuple(sorted(line_values.iteritems()))
+            groups.setdefault(key, []).append(line_id)
+        for key, line_ids in groups.iteritems():
+            self.write(cr, uid, line_ids, dict(key), context=context)
+        return True
+
+    def write_many2one_values(self, cr, uid, field_name, values,
+                              context=None):
+        """ Set a different value of a many2one field on many lines
+
+        ``values`` is a list of ``(line_id, value_id)`` tuples.  The lines
+        are updated by chunks with a single UPDATE, bypassing the ORM
+        ``write``: the stored function fields depending on the field are
+        recomputed as ``write`` does, but the overrides of ``write`` are
+        not called, so it must only be used for fields without other side
+        effects.
+
+        """
+        assert self._columns[field_name]._type == 'many2one', (
+            "%s is not a many2one field" % field_name)
+        if not values:
+            return True
+        ids = [line_id for line_id, __ in values]
+        self.check_access_rights(cr, uid, 'write')
+        self.check_access_rule(cr, uid, ids, 'write', context=context)
+        # the records depending on the previous values are recomputed too
+        result = self._store_get_values(cr, uid, ids, [field_name],
+                                        context=context) or []
+        for index in xrange(0, len(values), 1000):
+            chunk = values[index:index + 1000]
+            params = [uid]
+            for line_id, value_id in chunk:
+                params += [line_id, value_id or None]
+            cr.execute(
+                'UPDATE claim_line '
+                'SET "%s" = v.value_id, '
+                '    write_uid = %%s, '
+                '    write_date = (now() AT TIME ZONE \'UTC\') '
+                'FROM (VALUES %s) AS v(line_id, value_id) '
+                'WHERE claim_line.id = v.line_id' %
+                (field_name, ', '.join(['(%s, %s::integer)'] * len(chunk))),
+                params)
+        result += self._store_get_values(cr, uid, ids, [field_name],
+                                         context=context)
+        result.sort()
+        done = {}
+        for __, model_name, ids_to_update, fields_to_recompute in result:
+            key = (model_name, tuple(fields_to_recompute))
+            done.setdefault(key, set())
+            todo = [record_id for record_id in ids_to_update
+                    if record_id not in done[key]]
+            if not todo:
+                continue
+            done[key].update(todo)
+            self.pool[model_name]._store_set_values(
+                cr, uid, todo, fields_to_recompute, context)
         return True
 
     def set_warranty(self, cr, uid, ids, context=None):
         """ Calculate warranty limit and address """
-        for claim_line in self.browse(cr, uid, ids, context=context):
-            if not (claim_line.product_id and claim_line.invoice_line_id):
-                raise orm.except_orm(
-                    _('Error !'),
-                    _('Please set product and invoice.'))
-            self.set_warranty_limit(cr, uid, ids,
-                                    claim_line, context=context)
-            self.set_warranty_return_address(cr, uid, ids,
-                                             claim_line, context=context)
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        values, errors = self._get_warranty_values_batch(cr, uid, ids,
+                                                         context=context)
+        for line_id in ids:
+            if line_id in errors:
+                raise orm.except_orm(_('Error !'), errors[line_id])
+        self._write_grouped(cr, uid, values, context=context)
         return True
 
 
@@ -430,7 +803,8 @@ class crm_claim(orm.Model):
 
     def _get_sequence_number(self, cr, uid, context=None):
         seq_obj = self.pool.get('ir.sequence')
-        res = seq_obj.get(cr, uid, 'crm.claim.rma', context=context) or '/'
+        res = seq_obj.get_reserved(cr, uid, 'crm.claim.rma',
+                                   context=context) or '/'
         return res
 
     def _get_default_warehouse(self, cr, uid, context=None):
@@ -469,12 +843,36 @@ class crm_claim(orm.Model):
         std_default = {
             'invoice_ids': False,
             'picking_ids': False,
-            'number': self._get_sequence_number(cr, uid, context=context),
+            # the number is given by ``create``, only when the copy is
+            # actually created
+            'number': '/',
         }
         std_default.update(default)
         return super(crm_claim, self).copy_data(
             cr, uid, id, default=std_default, context=context)
 
+    def _get_total_return_value(self, cr, uid, ids, field_name, arg,
+                                context=None):
+        res = dict.fromkeys(ids, 0.0)
+        if not ids:
+            return res
+        cr.execute("SELECT claim_id, "
+                   "       SUM(unit_sale_price * product_returned_quantity) "
+                   "FROM claim_line "
+                   "WHERE claim_id IN %s "
+                   "GROUP BY claim_id",
+                   (tuple(ids),))
+        for claim_id, total in cr.fetchall():
+            res[claim_id] = total or 0.0
+        return res
+
+    def _get_claim_from_lines(self, cr, uid, ids, context=None):
+        """ Called by the store triggers of the claim lines """
+        cr.execute("SELECT DISTINCT claim_id FROM claim_line "
+                   "WHERE id IN %s AND claim_id IS NOT NULL",
+                   (tuple(ids),))
+        return [row[0] for row in cr.fetchall()]
+
     _columns = {
         'number': fields.char(
             'Number', readonly=True,
@@ -510,6 +908,18 @@ class crm_claim(orm.Model):
         'warehouse_id': fields.many2one(
             'stock.warehouse', string='Warehouse',
             required=True),
+        'total_return_value': fields.function(
+            _get_total_return_value, string='Total return', type='float',
+            store={
+                'crm.claim': (lambda self, cr, uid, ids, c=None: ids,
+                              ['claim_line_ids'], 10),
+                'claim.line': (_get_claim_from_lines,
+                               ['unit_sale_price',
+                                'product_returned_quantity',
+                                'claim_id'], 20),
+            },
+            select=True,
+            help="Sum of the total return of the lines"),
     }
 
     _defaults = {
@@ -545,7 +955,6 @@ class crm_claim(orm.Model):
                             create_lines=False, context=None):
         invoice_line_obj = self.pool.get('account.invoice.line')
         invoice_obj = self.pool.get('account.invoice')
-        product_obj = self.pool['product.product']
         claim_line_obj = self.pool.get('claim.line')
         company_obj = self.pool['res.company']
         warehouse_obj = self.pool['stock.warehouse']
@@ -560,34 +969,43 @@ class crm_claim(orm.Model):
                                                        context=context)
         invoice_lines = invoice_line_obj.browse(cr, uid, invoice_line_ids,
                                                 context=context)
+        company = company_obj.browse(cr, uid, company_id, context=context)
+        warehouse = warehouse_obj.browse(cr, uid, warehouse_id,
+                                         context=context)
+        # the warranty duration, return address and destination location
+        # are the same for all the lines of a product, compute them once
+        product_memo = {}
+
+        def product_values(product):
+            key = (product.id, warehouse_id, company_id, claim_type)
+            if key not in product_memo:
+                try:
+                    warranty_duration = claim_line_obj._warranty_duration(
+                        cr, uid, product, claim_type, context=context)
+                except ProductNoSupplier:
+                    warranty_duration = None
+                warranty_address = (
+                    claim_line_obj._warranty_return_address_values(
+                        cr, uid, [], product, company,
+                        warehouse, context=context))
+                product_memo[key] = (warranty_duration, warranty_address)
+            return product_memo[key]
 
         def warranty_values(invoice, product):
-            values = {}
-            try:
-                warranty = claim_line_obj._warranty_limit_values(
-                    cr, uid, [], invoice,
-                    claim_type, product,
-                    claim_date, context=context)
-            except (InvoiceNoDate, ProductNoSupplier):
-                # we don't mind at this point if the warranty can't be
-                # computed and we don't want to block the user
-                values.update({'guarantee_limit': False, 'warning': False})
-            else:
-                values.update(warranty)
-            company = company_obj.browse(cr, uid, company_id, context=context)
-            warehouse = warehouse_obj.browse(cr, uid, warehouse_id,
-                                             context=context)
-            warranty_address = claim_line_obj._warranty_return_address_values(
-                cr, uid, [], product, company,
-                warehouse, context=context)
+            warranty_duration, warranty_address = product_values(product)
+            # we don't mind at this point if the warranty can't be
+            # computed and we don't want to block the user
+            values = {'guarantee_limit': False, 'warning': False}
+            if (invoice and invoice.date_invoice and claim_type and
+                    claim_date and warranty_duration is not None):
+                values.update(claim_line_obj._warranty_limit_duration_values(
+                    cr, uid, [], invoice.date_invoice, warranty_duration,
+                    claim_date, context=context))
             values.update(warranty_address)
             return values
 
         if create_lines:  # happens when the invoice is changed
             for invoice_line in invoice_lines:
-                location_dest_id = claim_line_obj.get_destination_location(
-                    cr, uid, invoice_line.product_id.id,
-                    warehouse_id, context=context)
                 line = {
                     'name': invoice_line.name,
                     'claim_origine': "none",
@@ -595,7 +1013,6 @@ class crm_claim(orm.Model):
                     'product_id': invoice_line.product_id.id,
                     'product_returned_quantity': invoice_line.quantity,
                     'unit_sale_price': invoice_line.price_unit,
-                    'location_dest_id': location_dest_id,
                     'state': 'draft',
                 }
                 line.update(warranty_values(invoice_line.invoice_id,
@@ -603,45 +1020,9 @@ class crm_claim(orm.Model):
                 claim_lines.append(line)
         elif lines:  # happens when the date, warehouse or claim type is
                      # modified
-            for command in lines:
-                code = command[0]
-                assert code != 6, "command 6 not supported in on_change"
-                if code in (0, 1, 4):
-                    # 0: link a new record with values
-                    # 1: update an existing record with values
-                    # 4: link to existing record
-                    line_id = command[1]
-                    if code == 4:
-                        code = 1  # we want now to update values
-                        values = {}
-                    else:
-                        values = command[2]
-                    invoice_line_id = values.get('invoice_line_id')
-                    product_id = values.get('product_id')
-                    if code == 1:  # get the existing line
-                        # if the fields have not changed, fallback
-                        # on the database values
-                        browse_line = claim_line_obj.read(cr, uid,
-                                                          line_id,
-                                                          ['invoice_line_id',
-                                                           'product_id'],
-                                                          context=context)
-                        if not invoice_line_id:
-                            invoice_line_id = browse_line['invoice_line_id'][0]
-                        if not product_id:
-                            product_id = browse_line['product_id'][0]
-
-                    if invoice_line_id and product_id:
-                        invoice_line = invoice_line_obj.browse(cr, uid,
-                                                               invoice_line_id,
-                                                               context=context)
-                        product = product_obj.browse(cr, uid, product_id,
-                                                     context=context)
-                        values.update(warranty_values(invoice_line.invoice_id,
-                                                      product))
-                    claim_lines.append((code, line_id, values))
-                elif code in (2, 3, 5):
-                    claim_lines.append(command)
+            claim_lines = self._onchange_claim_lines_delta(
+                cr, uid, ids, lines, warehouse_id, claim_type, claim_date,
+                company_id, warranty_values, context=context)
 
         value = {'claim_line_ids': claim_lines}
         delivery_address_id = False
@@ -652,6 +1033,130 @@ class crm_claim(orm.Model):
 
         return {'value': value}
 
+    def _onchange_claim_lines_delta(self, cr, uid, ids, lines, warehouse_id,
+                                    claim_type, claim_date, company_id,
+                                    warranty_values, context=None):
+        """ Return the commands updating the warranty of the claim lines
+        after a change of date, warehouse or claim type.
+
+        The values stored on the claim and its lines are the inputs of the
+        previous computation: the warranty limit is only recomputed when
+        the date, the claim type, the invoice line or the product changed,
+        the return address when the warehouse, the company, the invoice
+        line or the product changed.  The warranty values pending in the
+        form were computed by a previous onchange for other inputs, they
+        are discarded, so reverting a change gives back the stored values.
+        Only the values which differ from the stored ones are returned;
+        the lines left unchanged are just linked again.
+
+        """
+        claim_line_obj = self.pool['claim.line']
+        invoice_line_obj = self.pool['account.invoice.line']
+        product_obj = self.pool['product.product']
+        limit_fields = ['guarantee_limit', 'warning']
+        address_fields = ['warranty_return_partner', 'warranty_type',
+                          'location_dest_id']
+        input_fields = ['invoice_line_id', 'product_id']
+
+        def m2o_id(value):
+            if isinstance(value, (tuple, list)):
+                return value[0]
+            return value or False
+
+        limit_changed = address_changed = True
+        if ids:
+            claim = self.read(cr, uid, ids[0],
+                              ['claim_type', 'date', 'company_id',
+                               'warehouse_id'],
+                              context=context)
+            limit_changed = (claim['claim_type'] != claim_type or
+                             claim['date'] != claim_date)
+            address_changed = (m2o_id(claim['warehouse_id']) !=
+                               warehouse_id or
+                               m2o_id(claim['company_id']) != company_id)
+
+        stored = {}
+        line_ids = [command[1] for command in lines if command[0] in (1, 4)]
+        if line_ids:
+            for line in claim_line_obj.read(
+                    cr, uid, line_ids,
+                    input_fields + limit_fields + address_fields,
+                    context=context):
+                stored[line['id']] = dict(
+                    (field, m2o_id(value)) for field, value in line.iteritems()
+                    if field != 'id')
+
+        # first pass: find the lines to recompute
+        todo = []
+        for command in lines:
+            code = command[0]
+            assert code != 6, "command 6 not supported in on_change"
+            if code in (2, 3, 5):
+                todo.append((command, None, None, None))
+                continue
+            line_id = command[1]
+            values = dict(command[2] or {}) if code != 4 else {}
+            current = dict(stored.get(line_id, {}))
+            current.update(values)
+            if code == 0:
+                inputs_changed = True
+            else:
+                inputs_changed = any(
+                    field in values and
+                    m2o_id(values[field]) != stored[line_id][field]
+                    for field in input_fields)
+            fields = []
+            if limit_changed or inputs_changed:
+                fields += limit_fields
+            if address_changed or inputs_changed:
+                fields += address_fields
+            if not (current.get('invoice_line_id') and
+                    current.get('product_id')):
+                fields = []
+            todo.append((command, values, current, fields))
+
+        # read all the invoice lines and products at once
+        invoice_line_ids = set()
+        product_ids = set()
+        for __, __, current, fields in todo:
+            if fields:
+                invoice_line_ids.add(m2o_id(current['invoice_line_id']))
+                product_ids.add(m2o_id(current['product_id']))
+        invoice_lines = dict(
+            (invoice_line.id, invoice_line) for invoice_line
+            in invoice_line_obj.browse(cr, uid, list(invoice_line_ids),
+                                       context=context))
+        products = dict(
+            (product.id, product) for product
+            in product_obj.browse(cr, uid, list(product_ids),
+                                  context=context))
+
+        claim_lines = []
+        for command, values, current, fields in todo:
+            if values is None:
+                claim_lines.append(command)
+                continue
+            code, line_id = command[0], command[1]
+            if code == 1:
+                for field in limit_fields + address_fields:
+                    values.pop(field, None)
+            if fields:
+                invoice_line = invoice_lines[
+                    m2o_id(current['invoice_line_id'])]
+                product = products[m2o_id(current['product_id'])]
+                warranty = warranty_values(invoice_line.invoice_id, product)
+                for field in fields:
+                    if (code == 0 or
+                            warranty[field] != stored[line_id].get(field)):
+                        values[field] = warranty[field]
+            if code == 0:
+                claim_lines.append((0, line_id, values))
+            elif values:
+                claim_lines.append((1, line_id, values))
+            else:
+                claim_lines.append((4, line_id, False))
+        return claim_lines
+
     def message_get_reply_to(self, cr, uid, ids, context=None):
         """ Override to get the reply_to of the parent project. """
         return [claim.section_id.message_get_reply_to()[0]
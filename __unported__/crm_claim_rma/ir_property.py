@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright 2013 Camptocamp
+#    Copyright 2009-2013 Akretion,
+#    Author: Emmanuel Samyn, Raphaël Valyi, Sébastien Beau,
+#            Benoît Guillot, Joel Grand-Guillaume
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+from openerp.osv import orm
+
+
+class ir_property(orm.Model):
+    """ The destination location of the claim lines depends on the supplier
+    stock location of the partners: clear the cache of the destination
+    locations when this property changes.
+
+    The properties of the partners are changed through ``res.partner``,
+    whose write clears the cache too: when a property is reset to its
+    default value, it is deleted in SQL.
+    """
+
+    _inherit = "ir.property"
+
+    _claim_location_properties = ('property_stock_supplier',)
+
+    def _clear_destination_location_cache(self, cr, uid, context=None):
+        claim_line_obj = self.pool.get('claim.line')
+        claim_line_obj.clear_destination_location_cache(cr, uid,
+                                                        context=context)
+
+    def _has_claim_location_property(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not ids:
+            return False
+        cr.execute("SELECT 1 FROM ir_property WHERE id IN %s AND name IN %s "
+                   "LIMIT 1",
+                   (tuple(ids), self._claim_location_properties))
+        return bool(cr.fetchone())
+
+    def create(self, cr, uid, vals, context=None):
+        res = super(ir_property, self).create(cr, uid, vals, context=context)
+        if vals.get('name') in self._claim_location_properties:
+            self._clear_destination_location_cache(cr, uid, context=context)
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+        # the properties are usually written through the partners, only
+        # the properties edited directly get here
+        clear = (vals.get('name') in self._claim_location_properties or
+                 self._has_claim_location_property(cr, uid, ids,
+                                                   context=context))
+        res = super(ir_property, self).write(cr, uid, ids, vals,
+                                             context=context)
+        if clear:
+            self._clear_destination_location_cache(cr, uid, context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        clear = self._has_claim_location_property(cr, uid, ids,
+                                                  context=context)
+        res = super(ir_property, self).unlink(cr, uid, ids, context=context)
+        if clear:
+            self._clear_destination_location_cache(cr, uid, context=context)
+        return res
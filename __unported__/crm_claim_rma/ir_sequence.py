@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright 2013 Camptocamp
+#    Copyright 2009-2013 Akretion,
+#    Author: Emmanuel Samyn, Raphaël Valyi, Sébastien Beau,
+#            Benoît Guillot, Joel Grand-Guillaume
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+import threading
+
+from openerp import tools
+from openerp.osv import orm, fields
+
+# numbers reserved in this process:
+# {(dbname, code, company_id): (sequence, [numbers])}
+_reserved_numbers = {}
+_reserved_lock = threading.Lock()
+
+
+class ir_sequence(orm.Model):
+    """ Hand out the numbers of a sequence from blocks reserved in memory
+
+    When 'Reserve Numbers' is checked on a sequence, each process reserves
+    a block of its numbers with a single query and hands them out from
+    memory, so the workers creating claims and pickings concurrently do
+    not query the sequence for each number.
+
+    The numbers are unique but are not ordered between the processes and
+    the numbers of a block which are not used are lost: there are gaps.
+    For this reason the reservation is only enabled on the sequences
+    whose contention is proven, and the 'No gap' sequences are never
+    reserved.  The other sequences go through the standard ``get``.
+
+    A block is dropped when its sequence is modified: the values of the
+    sequence are cached and compared with the ones the block was reserved
+    with.
+
+    """
+
+    _inherit = 'ir.sequence'
+
+    _columns = {
+        'reserve_numbers': fields.boolean(
+            'Reserve Numbers',
+            help="Each process reserves a block of numbers of the "
+                 "sequence at once, which lowers the contention between "
+                 "the concurrent transactions.  The numbers are not "
+                 "ordered and the numbers not used are lost. "
+                 "Only used by the claims and the pickings, and not with "
+                 "the 'No gap' implementation."),
+    }
+
+    _defaults = {
+        'reserve_numbers': False,
+    }
+
+    # number of numbers reserved at once
+    _reservation_size = 20
+
+    def _select_sequence(self, cr, uid, code, company_id, context=None):
+        """ Return the values of the sequence used for ``code``,
+        as chosen by ``_next``: the one of the company or a shared one """
+        company_obj = self.pool['res.company']
+        company_ids = company_obj.search(cr, uid, [], context=context)
+        seq_ids = self.search(cr, uid,
+                              [('code', '=', code),
+                               ('company_id', 'in', company_ids + [False])],
+                              context=context)
+        if not seq_ids:
+            return False
+        sequences = self.read(cr, uid, seq_ids,
+                              ['company_id', 'implementation',
+                               'reserve_numbers',
+                               'prefix', 'suffix', 'padding'],
+                              context=context)
+        preferred = [seq for seq in sequences
+                     if seq['company_id'] and
+                     seq['company_id'][0] == company_id]
+        return preferred[0] if preferred else sequences[0]
+
+    @tools.ormcache(skiparg=2)
+    def _get_reserved_sequence(self, cr, uid, code, company_id):
+        """ Return the values of the sequence used for ``code`` when its
+        numbers are reserved, False otherwise.
+
+        The result is cached by user until a sequence is modified.  The
+        date of the last modification is part of the values, so the blocks
+        reserved before a modification are recognized.
+        """
+        sequence = self._select_sequence(cr, uid, code, company_id)
+        if not (sequence and sequence['reserve_numbers'] and
+                sequence['implementation'] == 'standard'):
+            return False
+        cr.execute("SELECT write_date FROM ir_sequence WHERE id = %s",
+                   (sequence['id'],))
+        sequence['write_date'] = cr.fetchone()[0]
+        return sequence
+
+    def _reserve_numbers(self, cr, uid, sequence, context=None):
+        """ Reserve a block of numbers of a standard sequence """
+        cr.execute("SELECT nextval('ir_sequence_%03d') "
+                   "FROM generate_series(1, %%s)" % sequence['id'],
+                   (self._reservation_size,))
+        return [row[0] for row in cr.fetchall()]
+
+    def get_reserved(self, cr, uid, code, context=None):
+        """ Return the next number of the sequence ``code``, taken from
+        the block of numbers reserved by this process when the sequence
+        reserves its numbers, from ``get`` otherwise.
+
+        The company of the sequence is the one of ``force_company`` in the
+        context or the company of the user, like for ``get``.
+
+        """
+        if context is None:
+            context = {}
+        self.check_access_rights(cr, uid, 'read')
+        company_id = context.get('force_company')
+        if not company_id:
+            user_obj = self.pool['res.users']
+            company_id = user_obj._get_company(cr, uid, context=context)
+        sequence = self._get_reserved_sequence(cr, uid, code, company_id)
+        if not sequence:
+            return self.get(cr, uid, code, context=context)
+        key = (cr.dbname, code, company_id)
+        # the lock only protects the blocks in memory, the sequence is not
+        # queried while holding it
+        with _reserved_lock:
+            reserved, numbers = _reserved_numbers.get(key, (None, None))
+            if reserved is not None and reserved != sequence:
+                # the sequence has been modified since the reservation
+                del _reserved_numbers[key]
+                numbers = None
+            number = numbers.pop(0) if numbers else None
+        if number is None:
+            numbers = self._reserve_numbers(cr, uid, sequence,
+                                            context=context)
+            number = numbers.pop(0)
+            with _reserved_lock:
+                # keep the numbers left if another thread reserved a
+                # block of the same sequence meanwhile
+                reserved, left = _reserved_numbers.get(key, (None, []))
+                if reserved != sequence:
+                    left = []
+                _reserved_numbers[key] = (sequence, left + numbers)
+        d = self._interpolation_dict()
+        return (self._interpolate(sequence['prefix'], d) +
+                '%%0%sd' % sequence['padding'] % number +
+                self._interpolate(sequence['suffix'], d))
+
+    def _drop_reserved_numbers(self, cr, uid, ids, context=None):
+        """ Drop the numbers reserved in this process for the sequences
+        when they are modified.
+
+        The other processes drop their blocks of the sequences when they
+        notice the change of the values of the sequences, once they clear
+        their caches after the signal of the change.  Until then, they keep
+        using their current block.
+        """
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        with _reserved_lock:
+            for key, (sequence, __) in _reserved_numbers.items():
+                if key[0] == cr.dbname and sequence['id'] in ids:
+                    del _reserved_numbers[key]
+        # signals the other processes too
+        self._get_reserved_sequence.clear_cache(self)
+
+    def create(self, cr, uid, values, context=None):
+        seq_id = super(ir_sequence, self).create(cr, uid, values,
+                                                 context=context)
+        # the new sequence may be the one of a company
+        self._get_reserved_sequence.clear_cache(self)
+        return seq_id
+
+    def write(self, cr, uid, ids, values, context=None):
+        res = super(ir_sequence, self).write(cr, uid, ids, values,
+                                             context=context)
+        self._drop_reserved_numbers(cr, uid, ids, context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        self._drop_reserved_numbers(cr, uid, ids, context=context)
+        return super(ir_sequence, self).unlink(cr, uid, ids, context=context)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright 2013 Camptocamp
+#    Copyright 2009-2013 Akretion,
+#    Author: Emmanuel Samyn, Raphaël Valyi, Sébastien Beau,
+#            Benoît Guillot, Joel Grand-Guillaume
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+from openerp.osv import orm
+
+
+class product_supplierinfo(orm.Model):
+    """ The destination location of the claim lines depends on the first
+    supplier info of the products: clear the cache of the destination
+    locations when it changes.
+    """
+
+    _inherit = "product.supplierinfo"
+
+    # fields of the supplier infos used to find the destination location
+    _claim_location_fields = ('name', 'product_id', 'sequence',
+                              'warranty_return_partner')
+
+    def _clear_destination_location_cache(self, cr, uid, context=None):
+        claim_line_obj = self.pool.get('claim.line')
+        claim_line_obj.clear_destination_location_cache(cr, uid,
+                                                        context=context)
+
+    def create(self, cr, uid, vals, context=None):
+        res = super(product_supplierinfo, self).create(cr, uid, vals,
+                                                       context=context)
+        # only a new first supplier info changes the destination
+        supplierinfo = self.browse(cr, uid, res, context=context)
+        if supplierinfo.product_id.seller_info_id.id == res:
+            self._clear_destination_location_cache(cr, uid, context=context)
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(product_supplierinfo, self).write(cr, uid, ids, vals,
+                                                      context=context)
+        if set(vals).intersection(self._claim_location_fields):
+            self._clear_destination_location_cache(cr, uid, context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(product_supplierinfo, self).unlink(cr, uid, ids,
+                                                       context=context)
+        self._clear_destination_location_cache(cr, uid, context=context)
+        return res
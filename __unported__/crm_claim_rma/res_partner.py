@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright 2013 Camptocamp
+#    Copyright 2009-2013 Akretion,
+#    Author: Emmanuel Samyn, Raphaël Valyi, Sébastien Beau,
+#            Benoît Guillot, Joel Grand-Guillaume
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+from openerp.osv import orm
+
+
+class res_partner(orm.Model):
+    """ The destination location of the claim lines depends on the supplier
+    stock location of the partners.  It is a property which is deleted in
+    SQL when reset to its default value, clear the cache of the destination
+    locations when it is written.
+    """
+
+    _inherit = "res.partner"
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(res_partner, self).write(cr, uid, ids, vals,
+                                             context=context)
+        if 'property_stock_supplier' in vals:
+            claim_line_obj = self.pool.get('claim.line')
+            claim_line_obj.clear_destination_location_cache(cr, uid,
+                                                            context=context)
+        return res
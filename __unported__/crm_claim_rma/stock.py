@@ -38,8 +38,8 @@ class stock_picking(orm.Model):
                 seq_obj_name = self._name
             else:
                 seq_obj_name = 'stock.picking.' + vals['type']
-            vals['name'] = sequence_obj.get(cr, uid, seq_obj_name,
-                                            context=context)
+            vals['name'] = sequence_obj.get_reserved(cr, uid, seq_obj_name,
+                                                     context=context)
         new_id = super(stock_picking, self).create(cr, uid, vals,
                                                    context=context)
         return new_id
@@ -63,6 +63,20 @@ class stock_picking_in(orm.Model):
     }
 
 
+class stock_warehouse(orm.Model):
+
+    _inherit = "stock.warehouse"
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(stock_warehouse, self).write(cr, uid, ids, vals,
+                                                 context=context)
+        if 'lot_stock_id' in vals:
+            claim_line_obj = self.pool.get('claim.line')
+            claim_line_obj.clear_destination_location_cache(cr, uid,
+                                                            context=context)
+        return res
+
+
 # This part concern the case of a wrong picking out. We need to create a new
 # stock_move in a picking already open.
 # In order to don't have to confirm the stock_move we override the create and
@@ -71,14 +85,26 @@ class stock_move(orm.Model):
 
     _inherit = "stock.move"
 
+    def _get_claim_in_pickings(self, cr, uid, picking_ids, context=None):
+        """ Return a dict telling for each picking if it is an incoming
+        picking of a claim, in which case its moves are created confirmed
+
+        A dict built for a batch of moves can be passed in the context
+        with the key ``claim_in_pickings`` so the pickings are not read
+        again for each move.
+        """
+        cr.execute("SELECT id, claim_id IS NOT NULL AND type = 'in' "
+                   "FROM stock_picking WHERE id IN %s",
+                   (tuple(picking_ids),))
+        return dict(cr.fetchall())
+
     def create(self, cr, uid, vals, context=None):
-        move_id = super(stock_move, self
-                        ).create(cr, uid, vals, context=context)
-        if vals.get('picking_id'):
-            picking_obj = self.pool.get('stock.picking')
-            picking = picking_obj.browse(cr, uid, vals['picking_id'],
-                                         context=context)
-            if picking.claim_id and picking.type == u'in':
-                self.write(cr, uid, move_id, {'state': 'confirmed'},
-                           context=context)
-        return move_id
+        picking_id = vals.get('picking_id')
+        if picking_id:
+            claim_in_pickings = (context or {}).get('claim_in_pickings', {})
+            if picking_id not in claim_in_pickings:
+                claim_in_pickings = self._get_claim_in_pickings(
+                    cr, uid, [picking_id], context=context)
+            if claim_in_pickings.get(picking_id):
+                vals = dict(vals, state='confirmed')
+        return super(stock_move, self).create(cr, uid, vals, context=context)
@@ -19,3 +19,8 @@
 #
 ##############################################################################
 from . import test_lp_1282584
+from . import test_warranty
+from . import test_split_picking
+from . import test_sequence
+from . import test_refund
+from . import test_import
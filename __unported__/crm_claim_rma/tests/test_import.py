@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+import base64
+import codecs
+
+from openerp.tests import common
+
+
+class test_import(common.TransactionCase):
+    """ Test the import of claim lines from a CSV file """
+
+    def setUp(self):
+        super(test_import, self).setUp()
+        cr, uid = self.cr, self.uid
+
+        self.Import = self.registry('claim.line.import')
+        self.ClaimLine = self.registry('claim.line')
+        Claim = self.registry('crm.claim')
+        Product = self.registry('product.product')
+        Lot = self.registry('stock.production.lot')
+
+        self.product_id = Product.create(
+            cr, uid,
+            {'name': 'TEST IMPORT PRODUCT',
+             'default_code': 'TEST-IMPORT',
+             'type': 'product',
+             })
+        self.lot_id = Lot.create(
+            cr, uid,
+            {'name': 'TEST-IMPORT-SN-1',
+             'product_id': self.product_id,
+             })
+        self.claim_id = Claim.create(
+            cr, uid,
+            {'name': 'TEST CLAIM',
+             'claim_type': 'customer',
+             })
+
+    def test_import_csv(self):
+        """ The valid rows are imported, the other ones are reported """
+        cr, uid = self.cr, self.uid
+        data = '\n'.join([
+            'product,serial,quantity,subject,description',
+            'TEST-IMPORT,,2,damaged,Broken screen',
+            ',TEST-IMPORT-SN-1,,,',
+            'UNKNOWN,,1,,',
+            'TEST-IMPORT,,abc,,',
+        ])
+        wizard_id = self.Import.create(
+            cr, uid,
+            {'data': base64.b64encode(data),
+             'filename': 'lines.csv',
+             'chunk_size': 2,
+             },
+            context={'active_model': 'crm.claim',
+                     'active_id': self.claim_id})
+        self.Import.action_import(cr, uid, [wizard_id])
+        wizard = self.Import.browse(cr, uid, wizard_id)
+        self.assertEquals(wizard.state, 'done')
+        self.assertEquals(wizard.line_count, 2)
+        self.assertIn('Row 4', wizard.report)
+        self.assertIn('Row 5', wizard.report)
+        line_ids = self.ClaimLine.search(
+            cr, uid, [('claim_id', '=', self.claim_id)], order='id')
+        first, second = self.ClaimLine.browse(cr, uid, line_ids)
+        self.assertEquals(first.product_id.id, self.product_id)
+        self.assertEquals(first.product_returned_quantity, 2)
+        self.assertEquals(first.claim_origine, 'damaged')
+        self.assertEquals(first.name, 'Broken screen')
+        self.assertEquals(second.prodlot_id.id, self.lot_id)
+        self.assertEquals(second.product_id.id, self.product_id)
+
+    def test_import_ambiguous_product(self):
+        """ A reference shared by several products is reported """
+        cr, uid = self.cr, self.uid
+        self.registry('product.product').create(
+            cr, uid,
+            {'name': 'TEST IMPORT PRODUCT 2',
+             'default_code': 'TEST-IMPORT',
+             'type': 'product',
+             })
+        data = '\n'.join([
+            'product,serial,quantity',
+            'TEST-IMPORT,,1',
+            'TEST-IMPORT,TEST-IMPORT-SN-1,1',
+        ])
+        wizard_id = self.Import.create(
+            cr, uid,
+            {'data': base64.b64encode(data),
+             'filename': 'lines.csv',
+             },
+            context={'active_model': 'crm.claim',
+                     'active_id': self.claim_id})
+        self.Import.action_import(cr, uid, [wizard_id])
+        wizard = self.Import.browse(cr, uid, wizard_id)
+        self.assertEquals(wizard.line_count, 0)
+        self.assertIn('Row 2', wizard.report)
+        self.assertIn('Row 3', wizard.report)
+
+    def test_import_bom(self):
+        """ The byte order mark of a file saved by Excel is ignored """
+        cr, uid = self.cr, self.uid
+        data = codecs.BOM_UTF8 + '\n'.join([
+            'product,quantity',
+            'TEST-IMPORT,1',
+        ])
+        wizard_id = self.Import.create(
+            cr, uid,
+            {'data': base64.encodestring(data),
+             'filename': 'lines.csv',
+             },
+            context={'active_model': 'crm.claim',
+                     'active_id': self.claim_id})
+        self.Import.action_import(cr, uid, [wizard_id])
+        wizard = self.Import.browse(cr, uid, wizard_id)
+        self.assertEquals(wizard.line_count, 1)
+
+    def test_decode_file(self):
+        """ The file is decoded by chunks """
+        data = ''.join(chr(index % 256) for index in xrange(1000))
+        for encoded in (base64.b64encode(data), base64.encodestring(data)):
+            datafile = self.Import._decode_file(encoded, chunk_size=7)
+            self.assertEquals(datafile.read(), data)
+            datafile.close()
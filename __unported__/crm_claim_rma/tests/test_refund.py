@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+from openerp import netsvc
+from openerp.osv import orm
+from openerp.tests import common
+
+
+class ChunkCursor(object):
+    """ Refund a chunk in a savepoint of the cursor of the test instead of
+    its own transaction """
+
+    def __init__(self, cr):
+        self._cr = cr
+        cr.execute('SAVEPOINT test_chunk')
+
+    def commit(self):
+        self._cr.execute('RELEASE SAVEPOINT test_chunk')
+
+    def rollback(self):
+        self._cr.execute('ROLLBACK TO SAVEPOINT test_chunk')
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._cr, name)
+
+
+class test_refund(common.TransactionCase):
+    """ Test the refund of the claim lines """
+
+    def setUp(self):
+        super(test_refund, self).setUp()
+        cr, uid = self.cr, self.uid
+
+        self.Invoice = self.registry('account.invoice')
+        self.ClaimLine = self.registry('claim.line')
+        self.WizardRefund = self.registry('account.invoice.refund')
+        Claim = self.registry('crm.claim')
+
+        product_id = self.ref('product.product_product_4')
+        partner_id = self.ref('base.res_partner_12')
+        self.invoice_id = self.Invoice.create(
+            cr, uid,
+            {'partner_id': partner_id,
+             'account_id': self.ref('account.a_recv'),
+             'type': 'out_invoice',
+             'invoice_line': [
+                 (0, 0, {'name': 'TEST INVOICE LINE',
+                         'product_id': product_id,
+                         'account_id': self.ref('account.a_sale'),
+                         'quantity': 5,
+                         'price_unit': 100,
+                         })],
+             },
+            context={'type': 'out_invoice'})
+        wf_service = netsvc.LocalService('workflow')
+        wf_service.trg_validate(uid, 'account.invoice', self.invoice_id,
+                                'invoice_open', cr)
+        invoice = self.Invoice.browse(cr, uid, self.invoice_id)
+        self.stage_open_id = self.ref('crm_claim.stage_claim5')
+        self.claim_id = Claim.create(
+            cr, uid,
+            {'name': 'TEST CLAIM',
+             'claim_type': 'customer',
+             'partner_id': partner_id,
+             'invoice_id': self.invoice_id,
+             'stage_id': self.stage_open_id,
+             })
+        self.line_ids = []
+        for quantity in (2, 3):
+            self.line_ids.append(self.ClaimLine.create(
+                cr, uid,
+                {'name': 'TEST CLAIM LINE',
+                 'claim_origine': 'none',
+                 'product_id': product_id,
+                 'claim_id': self.claim_id,
+                 'warning': 'Valid',
+                 'invoice_line_id': invoice.invoice_line[0].id,
+                 'product_returned_quantity': quantity,
+                 }))
+        self.refund_context = {
+            'invoice_ids': [self.invoice_id],
+            'claim_line_ids': [(4, line_id, False)
+                               for line_id in self.line_ids],
+            'description': 'TEST REFUND',
+            'claim_id': self.claim_id,
+        }
+
+    def _refund(self):
+        cr, uid = self.cr, self.uid
+        context = dict(self.refund_context)
+        wizard_id = self.WizardRefund.create(cr, uid, {}, context=context)
+        self.WizardRefund.compute_refund(cr, uid, [wizard_id],
+                                         context=context)
+
+    def test_refund(self):
+        """ Each claim line is refunded with its returned quantity """
+        cr, uid = self.cr, self.uid
+        self._refund()
+        lines = self.ClaimLine.browse(cr, uid, self.line_ids)
+        for line in lines:
+            self.assertTrue(line.refund_line_id)
+            self.assertEquals(line.refund_line_id.quantity,
+                              line.product_returned_quantity)
+            self.assertEquals(line.refund_line_id.price_unit, 100)
+            self.assertEquals(line.refund_line_id.invoice_id.claim_id.id,
+                              self.claim_id)
+        with self.assertRaises(orm.except_orm):
+            self._refund()
+
+    def test_mass_refund(self):
+        """ The mass refund reports the result of each claim """
+        cr, uid = self.cr, self.uid
+        MassRefund = self.registry('claim.mass.refund')
+        Claim = self.registry('crm.claim')
+        other_claim_id = Claim.create(
+            cr, uid,
+            {'name': 'TEST CLAIM WITHOUT INVOICE',
+             'claim_type': 'customer',
+             'stage_id': self.stage_open_id,
+             })
+        wizard_id = MassRefund.create(
+            cr, uid,
+            {'claim_ids': [(6, 0, [self.claim_id, other_claim_id])]})
+        MassRefund.action_refund(cr, uid, [wizard_id])
+        wizard = MassRefund.browse(cr, uid, wizard_id)
+        self.assertEquals(wizard.state, 'done')
+        results = dict((result.claim_id.id, result.state)
+                       for result in wizard.result_ids)
+        self.assertEquals(results, {self.claim_id: 'done',
+                                    other_claim_id: 'failed'})
+        for line in self.ClaimLine.browse(cr, uid, self.line_ids):
+            self.assertTrue(line.refund_line_id)
+
+    def test_mass_refund_chunks(self):
+        """ The chunks refunded by the workers save their results """
+        cr, uid = self.cr, self.uid
+        MassRefund = self.registry('claim.mass.refund')
+        Claim = self.registry('crm.claim')
+        other_claim_ids = [
+            Claim.create(cr, uid,
+                         {'name': 'TEST CLAIM WITHOUT INVOICE',
+                          'claim_type': 'customer',
+                          'stage_id': self.stage_open_id,
+                          }),
+            Claim.create(cr, uid,
+                         {'name': 'TEST NEW CLAIM',
+                          'claim_type': 'customer',
+                          'invoice_id': self.invoice_id,
+                          'stage_id': self.ref('crm_claim.stage_claim1'),
+                          }),
+        ]
+        # only one worker, the chunks share the cursor of the test
+        MassRefund._chunk_cursor = lambda dbname: ChunkCursor(cr)
+        self.addCleanup(delattr, MassRefund, '_chunk_cursor')
+        wizard_id = MassRefund.create(
+            cr, uid,
+            {'claim_ids': [(6, 0, [self.claim_id] + other_claim_ids)],
+             'chunk_size': 1,
+             'workers': 1})
+        MassRefund.action_refund(cr, uid, [wizard_id])
+        wizard = MassRefund.browse(cr, uid, wizard_id)
+        self.assertEquals(wizard.state, 'done')
+        results = dict((result.claim_id.id, result.state)
+                       for result in wizard.result_ids)
+        self.assertEquals(results, {self.claim_id: 'done',
+                                    other_claim_ids[0]: 'failed',
+                                    other_claim_ids[1]: 'failed'})
+        for line in self.ClaimLine.browse(cr, uid, self.line_ids):
+            self.assertTrue(line.refund_line_id)
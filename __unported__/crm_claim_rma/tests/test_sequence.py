@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+from openerp.tests import common
+
+
+class test_sequence(common.TransactionCase):
+    """ Test the numbers given from the reserved blocks of the sequences """
+
+    def setUp(self):
+        super(test_sequence, self).setUp()
+        self.Sequence = self.registry('ir.sequence')
+        self.Claim = self.registry('crm.claim')
+        self.Sequence.write(self.cr, self.uid,
+                            [self.ref('crm_claim_rma.seq_claim')],
+                            {'reserve_numbers': True})
+
+    def test_reserved_numbers(self):
+        """ Numbers taken from a reserved block are unique """
+        cr, uid = self.cr, self.uid
+        reservation_size = self.Sequence._reservation_size
+        numbers = [self.Sequence.get_reserved(cr, uid, 'crm.claim.rma')
+                   for __ in xrange(reservation_size + 2)]
+        self.assertEqual(len(set(numbers)), len(numbers))
+        self.assertNotIn(False, numbers)
+
+    def test_not_reserved(self):
+        """ The numbers of a sequence without reservation follow """
+        cr, uid = self.cr, self.uid
+        seq_id = self.ref('crm_claim_rma.seq_claim')
+        self.Sequence.write(cr, uid, [seq_id], {'reserve_numbers': False})
+        first = self.Sequence.get_reserved(cr, uid, 'crm.claim.rma')
+        second = self.Sequence.get_reserved(cr, uid, 'crm.claim.rma')
+        self.assertEqual(int(second.split('/')[-1]) -
+                         int(first.split('/')[-1]), 1)
+
+    def test_modified_sequence(self):
+        """ The block reserved before a change of prefix is dropped """
+        cr, uid = self.cr, self.uid
+        seq_id = self.ref('crm_claim_rma.seq_claim')
+        self.Sequence.get_reserved(cr, uid, 'crm.claim.rma')
+        self.Sequence.write(cr, uid, [seq_id], {'prefix': 'TEST-'})
+        number = self.Sequence.get_reserved(cr, uid, 'crm.claim.rma')
+        self.assertTrue(number.startswith('TEST-'))
+
+    def test_copy_claim(self):
+        """ A copied claim receives a new number """
+        cr, uid = self.cr, self.uid
+        claim_id = self.Claim.create(
+            cr, uid,
+            {'name': 'TEST CLAIM',
+             'claim_type': 'customer',
+             })
+        copy_id = self.Claim.copy(cr, uid, claim_id)
+        claim, copy = self.Claim.browse(cr, uid, [claim_id, copy_id])
+        self.assertNotEqual(claim.number, '/')
+        self.assertNotEqual(copy.number, '/')
+        self.assertNotEqual(claim.number, copy.number)
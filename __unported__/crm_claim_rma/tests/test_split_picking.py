@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+from openerp.osv import orm
+from openerp.tests import common
+
+
+class test_split_picking(common.TransactionCase):
+    """ Test the creation of one product return by destination """
+
+    def setUp(self):
+        super(test_split_picking, self).setUp()
+        cr, uid = self.cr, self.uid
+
+        self.WizardMakePicking = self.registry('claim_make_picking.wizard')
+        self.ClaimLine = self.registry('claim.line')
+        Claim = self.registry('crm.claim')
+
+        product_id = self.ref('product.product_product_4')
+        self.partner_id = self.ref('base.res_partner_12')
+        self.supplier_id = self.ref('base.res_partner_1')
+        self.claim_id = Claim.create(
+            cr, uid,
+            {'name': 'TEST CLAIM',
+             'number': 'TEST CLAIM',
+             'claim_type': 'customer',
+             'delivery_address_id': self.partner_id,
+             })
+        claim = Claim.browse(cr, uid, self.claim_id)
+        self.warehouse_id = claim.warehouse_id.id
+        self.stock_location_id = claim.warehouse_id.lot_stock_id.id
+        self.supplier_location_id = self.ref('stock.stock_location_suppliers')
+        # a warning is set so the warranty is not computed again
+        self.line_id = self.ClaimLine.create(
+            cr, uid,
+            {'name': 'TEST CLAIM LINE 1',
+             'claim_origine': 'none',
+             'product_id': product_id,
+             'claim_id': self.claim_id,
+             'warning': 'Valid',
+             'warranty_return_partner': self.partner_id,
+             'location_dest_id': self.stock_location_id,
+             })
+        self.line2_id = self.ClaimLine.create(
+            cr, uid,
+            {'name': 'TEST CLAIM LINE 2',
+             'claim_origine': 'none',
+             'product_id': product_id,
+             'claim_id': self.claim_id,
+             'warning': 'Valid',
+             'warranty_return_partner': self.supplier_id,
+             'location_dest_id': self.supplier_location_id,
+             })
+        self.wiz_context = {
+            'active_id': self.claim_id,
+            'partner_id': self.partner_id,
+            'warehouse_id': self.warehouse_id,
+            'picking_type': 'in',
+            'product_return': True,
+        }
+
+    def _create_wizard(self, values):
+        values['claim_line_dest_location'] = self.stock_location_id
+        return self.WizardMakePicking.create(self.cr, self.uid, values,
+                                             context=self.wiz_context)
+
+    def test_split(self):
+        """ One picking is created for each destination """
+        cr, uid = self.cr, self.uid
+        wizard_id = self._create_wizard({'split_by_destination': True})
+        res = self.WizardMakePicking.action_create_picking(
+            cr, uid, [wizard_id], context=self.wiz_context)
+        self.assertEquals(res.get('res_model'), 'stock.picking.in')
+        picking_ids = res['domain'][0][2]
+        self.assertEquals(len(picking_ids), 2)
+        line, line2 = self.ClaimLine.browse(cr, uid,
+                                            [self.line_id, self.line2_id])
+        self.assertNotEquals(line.move_in_id.picking_id,
+                             line2.move_in_id.picking_id)
+        self.assertEquals(line2.move_in_id.picking_id.partner_id.id,
+                          self.supplier_id)
+        self.assertEquals(line2.move_in_id.location_dest_id.id,
+                          self.supplier_location_id)
+
+    def test_split_no_return_address(self):
+        """ The lines without return address go with the other lines """
+        cr, uid = self.cr, self.uid
+        line3_id = self.ClaimLine.create(
+            cr, uid,
+            {'name': 'TEST CLAIM LINE 3',
+             'claim_origine': 'none',
+             'product_id': self.ref('product.product_product_4'),
+             'claim_id': self.claim_id,
+             'warning': 'Valid',
+             'location_dest_id': self.stock_location_id,
+             })
+        wizard_id = self._create_wizard({'split_by_destination': True})
+        res = self.WizardMakePicking.action_create_picking(
+            cr, uid, [wizard_id], context=self.wiz_context)
+        picking_ids = res['domain'][0][2]
+        self.assertEquals(len(picking_ids), 2)
+        line, line3 = self.ClaimLine.browse(cr, uid, [self.line_id, line3_id])
+        self.assertEquals(line3.move_in_id.picking_id,
+                          line.move_in_id.picking_id)
+        self.assertEquals(line3.move_in_id.picking_id.partner_id.id,
+                          self.partner_id)
+
+    def test_no_split(self):
+        """ Without split, various destinations are refused """
+        cr, uid = self.cr, self.uid
+        wizard_id = self._create_wizard({})
+        with self.assertRaises(orm.except_orm):
+            self.WizardMakePicking.action_create_picking(
+                cr, uid, [wizard_id], context=self.wiz_context)
+
+    def test_default_get(self):
+        """ The defaults are computed from the lines without a picking """
+        cr, uid = self.cr, self.uid
+        defaults = self.WizardMakePicking.default_get(
+            cr, uid, ['claim_line_ids', 'claim_line_dest_location'],
+            context=self.wiz_context)
+        self.assertEquals(sorted(defaults['claim_line_ids']),
+                          sorted([self.line_id, self.line2_id]))
+        # the lines have various destinations
+        self.assertFalse(defaults['claim_line_dest_location'])
+        self.assertNotIn('claim_make_picking_line_ids', self.wiz_context)
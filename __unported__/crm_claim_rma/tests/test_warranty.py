@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+from datetime import datetime
+from openerp.osv import orm
+from openerp.tests import common
+
+
+class test_warranty(common.TransactionCase):
+    """ Test the computation of the warranty of the claim lines """
+
+    def setUp(self):
+        super(test_warranty, self).setUp()
+        cr, uid = self.cr, self.uid
+
+        self.ClaimLine = self.registry('claim.line')
+        Claim = self.registry('crm.claim')
+        Invoice = self.registry('account.invoice')
+        Product = self.registry('product.product')
+        Partner = self.registry('res.partner')
+
+        self.product_id = self.ref('product.product_product_4')
+        self.product2_id = self.ref('product.product_product_5')
+        Product.write(cr, uid, [self.product_id], {'warranty': 6})
+        Product.write(cr, uid, [self.product2_id], {'warranty': 24})
+
+        partner_id = self.ref('base.res_partner_3')
+        partner = Partner.browse(cr, uid, partner_id)
+        invoice_id = Invoice.create(
+            cr, uid,
+            {'partner_id': partner_id,
+             'account_id': partner.property_account_receivable.id,
+             'date_invoice': '2014-01-31',
+             'invoice_line': [
+                 (0, 0, {'name': 'Product 4',
+                         'product_id': self.product_id,
+                         'quantity': 1.0,
+                         'price_unit': 10.0}),
+                 (0, 0, {'name': 'Product 5',
+                         'product_id': self.product2_id,
+                         'quantity': 1.0,
+                         'price_unit': 10.0}),
+             ]})
+        invoice = Invoice.browse(cr, uid, invoice_id)
+        lines = dict((line.product_id.id, line.id)
+                     for line in invoice.invoice_line)
+
+        self.claim_id = Claim.create(
+            cr, uid,
+            {'name': 'TEST CLAIM',
+             'claim_type': 'customer',
+             'partner_id': partner_id,
+             'invoice_id': invoice_id,
+             'date': '2014-09-15 10:00:00',
+             })
+        self.line_id = self.ClaimLine.create(
+            cr, uid,
+            {'name': 'TEST CLAIM LINE 1',
+             'claim_origine': 'none',
+             'product_id': self.product_id,
+             'invoice_line_id': lines[self.product_id],
+             'claim_id': self.claim_id,
+             })
+        self.line2_id = self.ClaimLine.create(
+            cr, uid,
+            {'name': 'TEST CLAIM LINE 2',
+             'claim_origine': 'none',
+             'product_id': self.product2_id,
+             'invoice_line_id': lines[self.product2_id],
+             'claim_id': self.claim_id,
+             })
+
+    def test_set_warranty(self):
+        """ Each line gets the warranty of its own product """
+        cr, uid = self.cr, self.uid
+        self.ClaimLine.set_warranty(cr, uid, [self.line_id, self.line2_id])
+        line, line2 = self.ClaimLine.browse(cr, uid,
+                                            [self.line_id, self.line2_id])
+        self.assertEquals(line.guarantee_limit, '2014-07-31')
+        self.assertEquals(line.warning, 'Expired')
+        self.assertEquals(line2.guarantee_limit, '2016-01-31')
+        self.assertEquals(line2.warning, 'Valid')
+        self.assertTrue(line.warranty_type)
+        self.assertTrue(line.location_dest_id)
+
+    def test_set_warranty_line_invoice(self):
+        """ The invoice of the line takes precedence over the claim's one """
+        cr, uid = self.cr, self.uid
+        Invoice = self.registry('account.invoice')
+        claim_line = self.ClaimLine.browse(cr, uid, self.line_id)
+        invoice_id = Invoice.copy(cr, uid, claim_line.claim_id.invoice_id.id,
+                                  {'date_invoice': '2014-06-30'})
+        invoice = Invoice.browse(cr, uid, invoice_id)
+        invoice_line_id = [line.id for line in invoice.invoice_line
+                           if line.product_id.id == self.product_id][0]
+        self.ClaimLine.write(cr, uid, [self.line_id],
+                             {'invoice_line_id': invoice_line_id})
+        self.ClaimLine.set_warranty(cr, uid, [self.line_id, self.line2_id])
+        line, line2 = self.ClaimLine.browse(cr, uid,
+                                            [self.line_id, self.line2_id])
+        self.assertEquals(line.guarantee_limit, '2014-12-30')
+        self.assertEquals(line.warning, 'Valid')
+        self.assertEquals(line2.guarantee_limit, '2016-01-31')
+
+    def test_refresh_warranty_status(self):
+        """ The scheduled refresh gives the same warranty as set_warranty """
+        cr, uid = self.cr, self.uid
+        Invoice = self.registry('account.invoice')
+        claim_line = self.ClaimLine.browse(cr, uid, self.line_id)
+        invoice_id = Invoice.copy(cr, uid, claim_line.claim_id.invoice_id.id,
+                                  {'date_invoice': '2014-06-30'})
+        invoice = Invoice.browse(cr, uid, invoice_id)
+        invoice_line_id = [line.id for line in invoice.invoice_line
+                           if line.product_id.id == self.product_id][0]
+        self.ClaimLine.write(cr, uid, [self.line_id],
+                             {'invoice_line_id': invoice_line_id})
+        line_ids = [self.line_id, self.line2_id]
+        values, errors = self.ClaimLine._get_warranty_values_batch(
+            cr, uid, line_ids)
+        self.assertFalse(errors)
+        self.ClaimLine.refresh_warranty_status(cr, uid)
+        for line in self.ClaimLine.read(cr, uid, line_ids,
+                                        ['guarantee_limit', 'warning']):
+            self.assertEquals(line['guarantee_limit'],
+                              values[line['id']]['guarantee_limit'])
+            self.assertEquals(line['warning'], values[line['id']]['warning'])
+
+    def test_set_warranty_no_invoice(self):
+        """ The warranty cannot be computed without invoice line """
+        cr, uid = self.cr, self.uid
+        self.ClaimLine.write(cr, uid, [self.line2_id],
+                             {'invoice_line_id': False})
+        with self.assertRaises(orm.except_orm):
+            self.ClaimLine.set_warranty(cr, uid,
+                                        [self.line_id, self.line2_id])
+
+    def test_onchange_revert(self):
+        """ Reverting a change of date gives back the stored warranty """
+        cr, uid = self.cr, self.uid
+        Claim = self.registry('crm.claim')
+        self.ClaimLine.set_warranty(cr, uid, [self.line_id, self.line2_id])
+        claim = Claim.browse(cr, uid, self.claim_id)
+        args = (claim.invoice_id.id, claim.warehouse_id.id,
+                claim.claim_type)
+        lines = [(4, self.line_id, False), (4, self.line2_id, False)]
+
+        res = Claim.onchange_invoice_id(
+            cr, uid, [self.claim_id], *args,
+            claim_date='2014-03-01 10:00:00',
+            company_id=claim.company_id.id, lines=lines)
+        lines = res['value']['claim_line_ids']
+        self.assertEquals(lines, [(1, self.line_id, {'warning': 'Valid'}),
+                                  (4, self.line2_id, False)])
+
+        res = Claim.onchange_invoice_id(
+            cr, uid, [self.claim_id], *args,
+            claim_date=claim.date,
+            company_id=claim.company_id.id, lines=lines)
+        self.assertEquals(res['value']['claim_line_ids'],
+                          [(4, self.line_id, False),
+                           (4, self.line2_id, False)])
+
+    def test_warranty_limits(self):
+        """ The bulk computation gives the same limits than one by one """
+        starts = [datetime(2014, 1, 31), datetime(2014, 1, 31),
+                  datetime(2013, 12, 15), datetime(2012, 2, 29),
+                  datetime(2014, 1, 31)]
+        durations = [1.5, 6, 0.5, 12, 1.5]
+        limits = self.ClaimLine.warranty_limits(starts, durations)
+        self.assertEquals(limits[0], datetime(2014, 3, 14))
+        self.assertEquals(
+            limits,
+            [self.ClaimLine.warranty_limit(start, duration)
+             for start, duration in zip(starts, durations)])
@@ -22,3 +22,5 @@
 ##############################################################################
 from . import claim_make_picking
 from . import account_invoice_refund
+from . import claim_mass_refund
+from . import claim_line_import
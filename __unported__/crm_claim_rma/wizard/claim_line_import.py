@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright 2013 Camptocamp
+#    Copyright 2009-2013 Akretion,
+#    Author: Emmanuel Samyn, Raphaël Valyi, Sébastien Beau,
+#            Benoît Guillot, Joel Grand-Guillaume
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+import base64
+import codecs
+import csv
+import logging
+import tempfile
+from cStringIO import StringIO
+
+from openerp import tools
+from openerp.osv import fields, orm
+from openerp.tools.translate import _
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import openpyxl
+except ImportError:
+    _logger.debug('Cannot import openpyxl, the XLSX files cannot be '
+                  'imported.')
+    openpyxl = None
+
+
+class claim_line_import(orm.TransientModel):
+    """ Import the claim lines of one or several claims from a CSV or XLSX
+    file
+
+    The first row of the file contains the names of the columns:
+
+    * ``claim``: number of the claim, optional when the wizard is opened
+      from a claim
+    * ``product``: internal reference of the product, optional when a
+      serial number is given
+    * ``serial``: serial / lot number
+    * ``invoice``: number of the customer invoice, the invoice of the claim
+      is used when empty
+    * ``quantity``: returned quantity, 1 when empty
+    * ``subject``: claim subject (``none``, ``damaged``, ``error``, ...)
+    * ``description``: description of the line
+
+    The rows are read and imported by chunks: the claims, products, lots
+    and invoice lines of a chunk are searched at once, its lines are
+    created together and their warranty is computed in one batch.
+    A row which cannot be imported is reported with the reason and does
+    not prevent the import of the other rows.
+    """
+
+    _name = 'claim.line.import'
+    _description = 'Import of claim lines'
+
+    _columns = {
+        'data': fields.binary('File', required=True),
+        'filename': fields.char('File Name'),
+        'claim_id': fields.many2one(
+            'crm.claim',
+            string='Claim',
+            help="Claim of the lines when the file has no 'claim' column."),
+        'delimiter': fields.char('CSV Delimiter', size=1, required=True),
+        'chunk_size': fields.integer('Rows by Chunk', required=True),
+        'state': fields.selection(
+            [('draft', 'Draft'),
+             ('done', 'Done')],
+            string='State',
+            readonly=True),
+        'line_count': fields.integer('Imported Lines', readonly=True),
+        'report': fields.text('Errors', readonly=True),
+    }
+
+    def _get_claim_id(self, cr, uid, context=None):
+        if context is None:
+            context = {}
+        if context.get('active_model') != 'crm.claim':
+            return False
+        return context.get('active_id', False)
+
+    _defaults = {
+        'claim_id': _get_claim_id,
+        'delimiter': ',',
+        'chunk_size': 500,
+        'state': 'draft',
+    }
+
+    @staticmethod
+    def _cell_value(value):
+        """ Return the value of a cell as a stripped unicode string """
+        if value is None:
+            return u''
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return tools.ustr(value).strip()
+
+    def _decode_file(self, data, chunk_size=65536):
+        """ Decode the base64 content of the file by chunks in a temporary
+        file, so the decoded file is never held entirely in memory """
+        encoded = StringIO(data)
+        decoded = tempfile.TemporaryFile()
+        left = ''
+        while True:
+            chunk = encoded.read(chunk_size)
+            if not chunk:
+                break
+            chunk = left + chunk.replace('\n', '').replace('\r', '')
+            # base64 decodes by groups of 4 characters
+            size = len(chunk) - len(chunk) % 4
+            decoded.write(base64.b64decode(chunk[:size]))
+            left = chunk[size:]
+        if left:
+            decoded.write(base64.b64decode(left))
+        decoded.seek(0)
+        return decoded
+
+    def _read_rows(self, cr, uid, wizard, context=None):
+        """ Yield the rows of the file as lists of unicode strings """
+        datafile = self._decode_file(wizard.data or '')
+        try:
+            filename = (wizard.filename or '').lower()
+            if filename.endswith('.xlsx'):
+                if openpyxl is None:
+                    raise orm.except_orm(
+                        _('Error'),
+                        _('The Python library openpyxl is required to '
+                          'import XLSX files.'))
+                workbook = openpyxl.load_workbook(datafile, read_only=True,
+                                                  data_only=True)
+                for row in workbook.active.iter_rows():
+                    yield [self._cell_value(cell.value) for cell in row]
+            else:
+                # the files saved by Excel start with a byte order mark
+                if datafile.read(len(codecs.BOM_UTF8)) != codecs.BOM_UTF8:
+                    datafile.seek(0)
+                reader = csv.reader(datafile,
+                                    delimiter=str(wizard.delimiter))
+                for row in reader:
+                    yield [self._cell_value(value.decode('utf-8'))
+                           for value in row]
+        finally:
+            datafile.close()
+
+    def _lookup(self, cr, uid, rows, default_claim_id, context=None):
+        """ Search the claims, products, lots and invoice lines of a chunk
+        of rows, with one search by model, so the record rules apply.
+
+        The products, lots and invoices are returned as lists of ids by
+        reference, serial and number: several records may match them.
+        """
+        claim_obj = self.pool.get('crm.claim')
+        product_obj = self.pool.get('product.product')
+        lot_obj = self.pool.get('stock.production.lot')
+        invoice_obj = self.pool.get('account.invoice')
+        invoice_line_obj = self.pool.get('account.invoice.line')
+
+        def search_read(model, domain, field_names):
+            record_ids = model.search(cr, uid, domain, context=context)
+            if not record_ids:
+                return []
+            return model.read(cr, uid, record_ids, field_names,
+                              context=context, load='_classic_write')
+
+        claim_numbers = list(set(row['claim'] for row in rows
+                                 if row['claim']))
+        codes = list(set(row['product'] for row in rows if row['product']))
+        serials = list(set(row['serial'] for row in rows if row['serial']))
+        invoice_numbers = list(set(row['invoice'] for row in rows
+                                   if row['invoice']))
+        claims = {}
+        claim_ids = [default_claim_id] if default_claim_id else []
+        if claim_numbers:
+            for claim in search_read(claim_obj,
+                                     [('number', 'in', claim_numbers)],
+                                     ['number']):
+                claims[claim['number']] = claim['id']
+            claim_ids += claims.values()
+        claim_invoices = {}
+        if claim_ids:
+            claim_invoices = dict(
+                (claim['id'], claim['invoice_id']) for claim
+                in claim_obj.read(cr, uid, claim_ids, ['invoice_id'],
+                                  context=context, load='_classic_write'))
+        products = {}
+        if codes:
+            for product in search_read(product_obj,
+                                       [('default_code', 'in', codes)],
+                                       ['default_code']):
+                products.setdefault(product['default_code'],
+                                    []).append(product['id'])
+        lots = {}
+        if serials:
+            for lot in search_read(lot_obj, [('name', 'in', serials)],
+                                   ['name', 'product_id']):
+                lots.setdefault(lot['name'], []).append((lot['id'],
+                                                         lot['product_id']))
+        invoices = {}
+        if invoice_numbers:
+            for invoice in search_read(invoice_obj,
+                                       [('number', 'in', invoice_numbers),
+                                        ('type', '=', 'out_invoice')],
+                                       ['number']):
+                invoices.setdefault(invoice['number'],
+                                    []).append(invoice['id'])
+        invoice_lines = {}
+        invoice_ids = [invoice_id for invoice_id in claim_invoices.values()
+                       if invoice_id]
+        for invoice_id_list in invoices.itervalues():
+            invoice_ids += invoice_id_list
+        if invoice_ids:
+            for line in search_read(invoice_line_obj,
+                                    [('invoice_id', 'in', invoice_ids)],
+                                    ['invoice_id', 'product_id',
+                                     'price_unit']):
+                key = (line['invoice_id'], line['product_id'])
+                # the first line of the invoice for a product is kept
+                if (key not in invoice_lines or
+                        line['id'] < invoice_lines[key][0]):
+                    invoice_lines[key] = (line['id'], line['price_unit'])
+        return claims, claim_invoices, products, lots, invoices, invoice_lines
+
+    def _prepare_lines(self, cr, uid, rows, default_claim_id, context=None):
+        """ Return the values of the claim lines of a chunk of rows as a
+        list of ``(row_number, values)`` and the errors as a list of
+        ``(row_number, message)`` """
+        line_obj = self.pool.get('claim.line')
+        subjects = dict(line_obj._columns['claim_origine'].selection)
+        (claims, claim_invoices, products, lots,
+         invoices, invoice_lines) = self._lookup(cr, uid, rows,
+                                                 default_claim_id,
+                                                 context=context)
+        lines = []
+        errors = []
+        for row in rows:
+            number = row['row']
+            if row['claim']:
+                claim_id = claims.get(row['claim'])
+                if not claim_id:
+                    errors.append((number, _('Unknown claim %s') %
+                                   row['claim']))
+                    continue
+            elif default_claim_id:
+                claim_id = default_claim_id
+            else:
+                errors.append((number, _('No claim')))
+                continue
+            product_id = False
+            if row['product']:
+                product_ids = products.get(row['product'], [])
+                if not product_ids:
+                    errors.append((number, _('Unknown product %s') %
+                                   row['product']))
+                    continue
+                if len(product_ids) > 1:
+                    errors.append((number,
+                                   _('Several products have the reference '
+                                     '%s') % row['product']))
+                    continue
+                product_id = product_ids[0]
+            prodlot_id = False
+            if row['serial']:
+                candidates = [(lot_id, lot_product_id) for lot_id,
+                              lot_product_id in lots.get(row['serial'], [])
+                              if not product_id or
+                              lot_product_id == product_id]
+                if not candidates:
+                    errors.append((number,
+                                   _('Unknown serial / lot number %s') %
+                                   row['serial']))
+                    continue
+                if len(candidates) > 1:
+                    errors.append((number,
+                                   _('Several lots match the serial / lot '
+                                     'number %s') % row['serial']))
+                    continue
+                prodlot_id, product_id = candidates[0]
+            if not product_id:
+                errors.append((number, _('No product')))
+                continue
+            if row['invoice']:
+                invoice_ids = invoices.get(row['invoice'], [])
+                if not invoice_ids:
+                    errors.append((number, _('Unknown invoice %s') %
+                                   row['invoice']))
+                    continue
+                if len(invoice_ids) > 1:
+                    errors.append((number,
+                                   _('Several invoices have the number '
+                                     '%s') % row['invoice']))
+                    continue
+                invoice_id = invoice_ids[0]
+            else:
+                invoice_id = claim_invoices.get(claim_id)
+            invoice_line_id, price_unit = invoice_lines.get(
+                (invoice_id, product_id), (False, 0.0))
+            if row['invoice'] and not invoice_line_id:
+                errors.append((number, _('The product is not on the '
+                                         'invoice %s') % row['invoice']))
+                continue
+            subject = row['subject'] or 'none'
+            if subject not in subjects:
+                errors.append((number, _('Unknown subject %s') % subject))
+                continue
+            try:
+                quantity = float(row['quantity'] or 1.0)
+            except ValueError:
+                errors.append((number, _('Wrong quantity %s') %
+                               row['quantity']))
+                continue
+            values = {
+                'claim_id': claim_id,
+                'claim_origine': subject,
+                'product_id': product_id,
+                'prodlot_id': prodlot_id,
+                'invoice_line_id': invoice_line_id,
+                'unit_sale_price': price_unit,
+                'product_returned_quantity': quantity,
+                'state': 'draft',
+            }
+            if row['description']:
+                values['name'] = row['description']
+            lines.append((number, values))
+        return lines, errors
+
+    def _create_lines(self, cr, uid, lines, context=None):
+        """ Create the lines of a chunk and return the ids of the created
+        lines and the errors.
+
+        The lines are created together in a savepoint, when it fails they
+        are created one by one to find the failing rows.
+        """
+        line_obj = self.pool.get('claim.line')
+        cr.execute('SAVEPOINT claim_line_import')
+        try:
+            line_ids = [(number, line_obj.create(cr, uid, values,
+                                                 context=context))
+                        for number, values in lines]
+        except Exception:
+            cr.execute('ROLLBACK TO SAVEPOINT claim_line_import')
+        else:
+            cr.execute('RELEASE SAVEPOINT claim_line_import')
+            return line_ids, []
+        line_ids = []
+        errors = []
+        for number, values in lines:
+            cr.execute('SAVEPOINT claim_line_import')
+            try:
+                line_id = line_obj.create(cr, uid, values, context=context)
+            except orm.except_orm as err:
+                cr.execute('ROLLBACK TO SAVEPOINT claim_line_import')
+                errors.append((number, err.value))
+            except Exception as err:
+                cr.execute('ROLLBACK TO SAVEPOINT claim_line_import')
+                errors.append((number, tools.ustr(err)))
+            else:
+                cr.execute('RELEASE SAVEPOINT claim_line_import')
+                line_ids.append((number, line_id))
+        return line_ids, errors
+
+    def _import_chunk(self, cr, uid, rows, default_claim_id, context=None):
+        """ Import a chunk of rows, return the number of created lines and
+        the errors """
+        line_obj = self.pool.get('claim.line')
+        lines, errors = self._prepare_lines(cr, uid, rows, default_claim_id,
+                                            context=context)
+        line_ids, create_errors = self._create_lines(cr, uid, lines,
+                                                     context=context)
+        errors += create_errors
+        line_values = dict(lines)
+        rows_by_line = dict((line_id, number) for number, line_id in line_ids)
+        with_invoice = [line_id for number, line_id in line_ids
+                        if line_values[number]['invoice_line_id']]
+        values, warranty_errors = line_obj._get_warranty_values_batch(
+            cr, uid, with_invoice, context=context)
+        line_obj._write_grouped(cr, uid, values, context=context)
+        for line_id, message in warranty_errors.iteritems():
+            errors.append((rows_by_line[line_id],
+                           _('Line imported, warranty not computed: %s') %
+                           message))
+        return len(line_ids), errors
+
+    def action_import(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        assert len(ids) == 1, "Only 1 ID expected"
+        wizard = self.browse(cr, uid, ids[0], context=context)
+        chunk_size = max(wizard.chunk_size, 1)
+        rows = self._read_rows(cr, uid, wizard, context=context)
+        header = [name.lower() for name in next(rows, [])]
+        columns = ('claim', 'product', 'serial', 'invoice', 'quantity',
+                   'subject', 'description')
+        if not ('product' in header or 'serial' in header):
+            raise orm.except_orm(
+                _('Error'),
+                _("The first row of the file must contain the names of the "
+                  "columns, with at least a 'product' or a 'serial' "
+                  "column."))
+        indexes = dict((column, header.index(column)) for column in columns
+                       if column in header)
+        default_claim_id = wizard.claim_id.id
+        line_count = 0
+        errors = []
+        chunk = []
+        # the row numbers start at 1 with the header
+        for number, values in enumerate(rows, 2):
+            if not any(values):
+                continue
+            row = {'row': number}
+            for column in columns:
+                index = indexes.get(column)
+                row[column] = (values[index] if index is not None and
+                               index < len(values) else u'')
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                count, chunk_errors = self._import_chunk(
+                    cr, uid, chunk, default_claim_id, context=context)
+                line_count += count
+                errors += chunk_errors
+                chunk = []
+        if chunk:
+            count, chunk_errors = self._import_chunk(
+                cr, uid, chunk, default_claim_id, context=context)
+            line_count += count
+            errors += chunk_errors
+        errors.sort()
+        report = '\n'.join(_('Row %d: %s') % (number, message)
+                           for number, message in errors)
+        self.write(cr, uid, ids,
+                   {'state': 'done',
+                    'line_count': line_count,
+                    'report': report},
+                   context=context)
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Import Claim Lines'),
+            'res_model': self._name,
+            'res_id': ids[0],
+            'view_type': 'form',
+            'view_mode': 'form',
+            'target': 'new',
+            'context': context,
+        }
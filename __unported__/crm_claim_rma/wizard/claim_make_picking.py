@@ -48,6 +48,11 @@ class claim_make_picking(orm.TransientModel):
             'claim_picking_id',
             'claim_line_id',
             string='Claim lines'),
+        'split_by_destination': fields.boolean(
+            'Split by destination',
+            help="For a product return, when the lines have different "
+                 "destination locations or return addresses, create one "
+                 "picking for each of them instead of refusing."),
     }
 
     def _get_claim_lines(self, cr, uid, context):
@@ -55,6 +60,9 @@ class claim_make_picking(orm.TransientModel):
         # of raise an error
         if context is None:
             context = {}
+        # already computed by default_get
+        if 'claim_make_picking_line_ids' in context:
+            return context['claim_make_picking_line_ids']
         line_obj = self.pool.get('claim.line')
         if context.get('picking_type') == 'out':
             move_field = 'move_out_id'
@@ -93,33 +101,55 @@ class claim_make_picking(orm.TransientModel):
                 context=context)['property_stock_customer'][0]
         return loc_id
 
+    def _get_lines_destinations(self, cr, uid, line_ids, context):
+        """Return a tuple with the list of the distinct destination
+        locations and the list of the distinct return partners of the
+        lines.
+
+        They are computed with a single query."""
+        line_obj = self.pool.get('claim.line')
+        locations = set()
+        partners = set()
+        if line_ids:
+            cr.execute("""
+                SELECT DISTINCT
+                       line.location_dest_id,
+                       CASE WHEN line.location_dest_id IS NULL
+                            THEN line.product_id END,
+                       CASE WHEN line.location_dest_id IS NULL
+                            THEN claim.warehouse_id END,
+                       line.warranty_return_partner
+                FROM claim_line line
+                LEFT JOIN crm_claim claim ON claim.id = line.claim_id
+                WHERE line.id IN %s
+                """, (tuple(line_ids),))
+            for location_id, product_id, warehouse_id, partner_id in \
+                    cr.fetchall():
+                if not location_id and warehouse_id:
+                    location_id = line_obj.get_destination_location(
+                        cr, uid, product_id, warehouse_id, context=context)
+                locations.add(location_id or False)
+                if partner_id:
+                    partners.add(partner_id)
+        return list(locations), list(partners)
+
     def _get_common_dest_location_from_line(self, cr, uid, line_ids, context):
         """Return the ID of the common location between all lines. If no common
         destination was  found, return False"""
-        loc_id = False
-        line_obj = self.pool.get('claim.line')
-        line_location = []
-        for line in line_obj.browse(cr, uid, line_ids, context=context):
-            if line.location_dest_id.id not in line_location:
-                line_location.append(line.location_dest_id.id)
-        if len(line_location) == 1:
-            loc_id = line_location[0]
-        return loc_id
+        locations, __ = self._get_lines_destinations(cr, uid, line_ids,
+                                                     context=context)
+        if len(locations) == 1:
+            return locations[0]
+        return False
 
     def _get_common_partner_from_line(self, cr, uid, line_ids, context):
         """Return the ID of the common partner between all lines. If no common
         partner was found, return False"""
-        partner_id = False
-        line_obj = self.pool.get('claim.line')
-        line_partner = []
-        for line in line_obj.browse(cr, uid, line_ids, context=context):
-            if (line.warranty_return_partner
-                    and line.warranty_return_partner.id
-                    not in line_partner):
-                line_partner.append(line.warranty_return_partner.id)
-        if len(line_partner) == 1:
-            partner_id = line_partner[0]
-        return partner_id
+        __, partners = self._get_lines_destinations(cr, uid, line_ids,
+                                                    context=context)
+        if len(partners) == 1:
+            return partners[0]
+        return False
 
     # Get default destination location
     def _get_dest_loc(self, cr, uid, context):
@@ -147,25 +177,115 @@ class claim_make_picking(orm.TransientModel):
         'claim_line_source_location': _get_source_loc,
         'claim_line_dest_location': _get_dest_loc,
         'claim_line_ids': _get_claim_lines,
+        'split_by_destination': False,
     }
 
+    def default_get(self, cr, uid, fields_list, context=None):
+        """ Compute the claim lines only once for the defaults of the lines
+        and of the destination location """
+        if context is None:
+            context = {}
+        if 'claim_line_ids' in fields_list:
+            line_ids = self._get_claim_lines(cr, uid, context=context)
+            context = dict(context, claim_make_picking_line_ids=line_ids)
+        return super(claim_make_picking, self).default_get(
+            cr, uid, fields_list, context=context)
+
     def action_cancel(self, cr, uid, ids, context=None):
         return {'type': 'ir.actions.act_window_close'}
 
+    def _get_lines_by_destination(self, cr, uid, line_ids, context=None):
+        """Group the lines by destination location and return partner.
+
+        Return a list of tuples ``(location_dest_id, partner_id, line_ids)``.
+        """
+        cr.execute("""
+            SELECT location_dest_id, warranty_return_partner, array_agg(id)
+            FROM claim_line
+            WHERE id IN %s
+            GROUP BY location_dest_id, warranty_return_partner
+            ORDER BY min(id)
+            """, (tuple(line_ids),))
+        return cr.fetchall()
+
+    def _create_picking(self, cr, uid, wizard, claim, lines, p_type,
+                        partner_id, location_dest_id, note, context=None):
+        """Create and confirm a picking for the claim lines, link the moves
+        to the lines and return the ID of the picking"""
+        picking_obj = self.pool.get('stock.picking')
+        move_obj = self.pool.get('stock.move')
+        line_obj = self.pool.get('claim.line')
+        if p_type == 'out':
+            write_field = 'move_out_id'
+        else:
+            write_field = 'move_in_id'
+        date = time.strftime(DEFAULT_SERVER_DATETIME_FORMAT)
+        # create picking
+        picking_id = picking_obj.create(
+            cr, uid,
+            {'origin': claim.number,
+             'type': p_type,
+             'move_type': 'one',  # direct
+             'state': 'draft',
+             'date': date,
+             'partner_id': partner_id,
+             'invoice_state': "none",
+             'company_id': claim.company_id.id,
+             'location_id': wizard.claim_line_source_location.id,
+             'location_dest_id': location_dest_id,
+             'note': note,
+             'claim_id': claim.id,
+             },
+            context=context)
+        # Create picking lines
+        moves_values = []
+        for wizard_claim_line in lines:
+            moves_values.append((
+                wizard_claim_line.id,
+                {'name': wizard_claim_line.product_id.name_template,
+                 'priority': '0',
+                 'date': date,
+                 'date_expected': date,
+                 'product_id': wizard_claim_line.product_id.id,
+                 'product_qty': wizard_claim_line.product_returned_quantity,
+                 'product_uom': wizard_claim_line.product_id.uom_id.id,
+                 'partner_id': partner_id,
+                 'prodlot_id': wizard_claim_line.prodlot_id.id,
+                 'picking_id': picking_id,
+                 'state': 'draft',
+                 'price_unit': wizard_claim_line.unit_sale_price,
+                 'company_id': claim.company_id.id,
+                 'location_id': wizard.claim_line_source_location.id,
+                 'location_dest_id': location_dest_id,
+                 'note': note,
+                 }))
+        # the incoming moves of a claim are created confirmed
+        move_context = dict(context or {},
+                            claim_in_pickings={picking_id: p_type == 'in'})
+        line_moves = []
+        for line_id, move_values in moves_values:
+            move_id = move_obj.create(cr, uid, move_values,
+                                      context=move_context)
+            line_moves.append((line_id, move_id))
+        line_obj.write_many2one_values(cr, uid, write_field, line_moves,
+                                       context=context)
+        wf_service = netsvc.LocalService("workflow")
+        wf_service.trg_validate(uid, 'stock.picking',
+                                picking_id, 'button_confirm', cr)
+        picking_obj.action_assign(cr, uid, [picking_id])
+        return picking_id
+
     # If "Create" button pressed
     def action_create_picking(self, cr, uid, ids, context=None):
-        picking_obj = self.pool.get('stock.picking')
         if context is None:
             context = {}
         view_obj = self.pool.get('ir.ui.view')
         name = 'RMA picking out'
         if context.get('picking_type') == 'out':
             p_type = 'out'
-            write_field = 'move_out_id'
             note = 'RMA picking out'
         else:
             p_type = 'in'
-            write_field = 'move_in_id'
             if context.get('picking_type'):
                 note = 'RMA picking ' + str(context.get('picking_type'))
                 name = note
@@ -181,10 +301,45 @@ class claim_make_picking(orm.TransientModel):
                                                   context=context)
         partner_id = claim.delivery_address_id.id
         line_ids = [x.id for x in wizard.claim_line_ids]
+        location_dest_id = wizard.claim_line_dest_location.id
+        # list of (partner, destination location, lines) for which a
+        # picking has to be created
+        groups = [(partner_id, location_dest_id, wizard.claim_line_ids)]
         # In case of product return, we don't allow one picking for various
         # product if location are different
         # or if partner address is different
-        if context.get('product_return'):
+        if context.get('product_return') and wizard.split_by_destination:
+            # create one picking by destination instead
+            self.pool.get('claim.line').auto_set_warranty(cr, uid,
+                                                          line_ids,
+                                                          context=context)
+            lines = dict((line.id, line) for line in wizard.claim_line_ids)
+            dest_groups = self._get_lines_by_destination(cr, uid, line_ids,
+                                                         context=context)
+            # like in a single product return, the lines without return
+            # address go with the other lines
+            partner_ids = set(group_partner_id for __, group_partner_id, __
+                              in dest_groups if group_partner_id)
+            if len(partner_ids) == 1:
+                default_partner_id = partner_ids.pop()
+            else:
+                default_partner_id = partner_id
+            groups = []
+            group_lines = {}
+            for group_location_id, group_partner_id, group_line_ids in \
+                    dest_groups:
+                key = (group_partner_id or default_partner_id,
+                       group_location_id or location_dest_id)
+                if key not in group_lines:
+                    group_lines[key] = []
+                    groups.append(key + (group_lines[key],))
+                group_lines[key].extend(lines[line_id]
+                                        for line_id in group_line_ids)
+            if len(groups) == 1:
+                # keep the location chosen in the wizard
+                groups = [(groups[0][0], location_dest_id,
+                           wizard.claim_line_ids)]
+        elif context.get('product_return'):
             common_dest_loc_id = self._get_common_dest_location_from_line(
                 cr, uid, line_ids, context=context)
             if not common_dest_loc_id:
@@ -205,55 +360,21 @@ class claim_make_picking(orm.TransientModel):
                       'destination addresses, please choose line with a '
                       'same address.'))
             partner_id = common_dest_partner_id
-        # create picking
-        picking_id = picking_obj.create(
-            cr, uid,
-            {'origin': claim.number,
-             'type': p_type,
-             'move_type': 'one',  # direct
-             'state': 'draft',
-             'date': time.strftime(DEFAULT_SERVER_DATETIME_FORMAT),
-             'partner_id': partner_id,
-             'invoice_state': "none",
-             'company_id': claim.company_id.id,
-             'location_id': wizard.claim_line_source_location.id,
-             'location_dest_id': wizard.claim_line_dest_location.id,
-             'note': note,
-             'claim_id': claim.id,
-             },
-            context=context)
-        # Create picking lines
-        fmt = DEFAULT_SERVER_DATETIME_FORMAT
-        for wizard_claim_line in wizard.claim_line_ids:
-            move_obj = self.pool.get('stock.move')
-            move_id = move_obj.create(
-                cr, uid,
-                {'name': wizard_claim_line.product_id.name_template,
-                 'priority': '0',
-                 'date': time.strftime(fmt),
-                 'date_expected': time.strftime(fmt),
-                 'product_id': wizard_claim_line.product_id.id,
-                 'product_qty': wizard_claim_line.product_returned_quantity,
-                 'product_uom': wizard_claim_line.product_id.uom_id.id,
-                 'partner_id': partner_id,
-                 'prodlot_id': wizard_claim_line.prodlot_id.id,
-                 'picking_id': picking_id,
-                 'state': 'draft',
-                 'price_unit': wizard_claim_line.unit_sale_price,
-                 'company_id': claim.company_id.id,
-                 'location_id': wizard.claim_line_source_location.id,
-                 'location_dest_id': wizard.claim_line_dest_location.id,
-                 'note': note,
-                 },
-                context=context)
-            self.pool.get('claim.line').write(
-                cr, uid, wizard_claim_line.id,
-                {write_field: move_id}, context=context)
-        wf_service = netsvc.LocalService("workflow")
-        if picking_id:
-            wf_service.trg_validate(uid, 'stock.picking',
-                                    picking_id, 'button_confirm', cr)
-            picking_obj.action_assign(cr, uid, [picking_id])
+            groups = [(partner_id, location_dest_id, wizard.claim_line_ids)]
+        picking_ids = []
+        for group_partner_id, group_location_id, lines in groups:
+            picking_ids.append(self._create_picking(
+                cr, uid, wizard, claim, lines, p_type, group_partner_id,
+                group_location_id, note, context=context))
+        if len(picking_ids) > 1:
+            return {
+                'name': '%s' % name,
+                'view_type': 'form',
+                'view_mode': 'tree,form',
+                'domain': [('id', 'in', picking_ids)],
+                'res_model': model,
+                'type': 'ir.actions.act_window',
+            }
         domain = ("[('type', '=', '%s'), ('partner_id', '=', %s)]" %
                   (p_type, partner_id))
         return {
@@ -263,7 +384,7 @@ class claim_make_picking(orm.TransientModel):
             'view_id': view_id,
             'domain': domain,
             'res_model': model,
-            'res_id': picking_id,
+            'res_id': picking_ids[0],
             'type': 'ir.actions.act_window',
         }
 
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Copyright 2013 Camptocamp
+#    Copyright 2009-2013 Akretion,
+#    Author: Emmanuel Samyn, Raphaël Valyi, Sébastien Beau,
+#            Benoît Guillot, Joel Grand-Guillaume
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+import logging
+import threading
+from Queue import Queue, Empty
+
+from openerp import pooler, tools
+from openerp.osv import fields, orm
+from openerp.tools.translate import _
+
+_logger = logging.getLogger(__name__)
+
+
+class claim_mass_refund(orm.TransientModel):
+    """ Create the refunds of many claims
+
+    The claims are split in chunks which are refunded by several threads,
+    each one with its own cursor: the refunds of a chunk and their results
+    are committed together when the chunk is done.  The refund of each
+    claim is done in a savepoint, so a failing claim does not prevent the
+    refund of the other ones of its chunk.  When there is only one chunk,
+    it is refunded in the transaction of the wizard.
+
+    Only the open claims are refunded, like with the button of the claim.
+    """
+
+    _name = 'claim.mass.refund'
+    _description = 'Wizard to create the refunds of many claims'
+
+    _columns = {
+        'claim_ids': fields.many2many(
+            'crm.claim',
+            'claim_mass_refund_claim_rel',
+            'wizard_id',
+            'claim_id',
+            string='Claims'),
+        'chunk_size': fields.integer(
+            'Claims by Chunk',
+            required=True,
+            help="Number of claims refunded and committed together."),
+        'workers': fields.integer(
+            'Workers',
+            required=True,
+            help="Number of chunks refunded at the same time."),
+        'state': fields.selection(
+            [('draft', 'Draft'),
+             ('done', 'Done')],
+            string='State',
+            readonly=True),
+        'result_ids': fields.one2many(
+            'claim.mass.refund.result',
+            'wizard_id',
+            string='Results',
+            readonly=True),
+    }
+
+    def _get_claim_ids(self, cr, uid, context=None):
+        if context is None:
+            context = {}
+        if context.get('active_model') != 'crm.claim':
+            return []
+        return context.get('active_ids') or []
+
+    _defaults = {
+        'claim_ids': _get_claim_ids,
+        'chunk_size': 50,
+        'workers': 4,
+        'state': 'draft',
+    }
+
+    def _refund_claim(self, cr, uid, claim, context=None):
+        """ Create the refund of a claim like the 'New Refund' button
+        of the claim """
+        refund_obj = self.pool.get('account.invoice.refund')
+        if not claim.invoice_id:
+            raise orm.except_orm(
+                _('Error !'),
+                _('The claim has no invoice.'))
+        ctx = dict(context or {},
+                   invoice_ids=[claim.invoice_id.id],
+                   claim_line_ids=[(4, line.id, False)
+                                   for line in claim.claim_line_ids],
+                   description=claim.name,
+                   claim_id=claim.id)
+        refund_id = refund_obj.create(cr, uid, {}, context=ctx)
+        refund_obj.compute_refund(cr, uid, [refund_id], context=ctx)
+
+    def _refund_claims(self, cr, uid, claim_ids, context=None):
+        """ Refund the claims and return the result of each one
+
+        The refund of each claim is done in a savepoint.
+        """
+        claim_obj = self.pool.get('crm.claim')
+        results = []
+        for claim in claim_obj.browse(cr, uid, claim_ids, context=context):
+            if claim.state != 'open':
+                results.append((claim.id, 'failed',
+                                _('Only the claims in progress can be '
+                                  'refunded.')))
+                continue
+            cr.execute('SAVEPOINT claim_mass_refund')
+            try:
+                self._refund_claim(cr, uid, claim, context=context)
+            except orm.except_orm as err:
+                cr.execute('ROLLBACK TO SAVEPOINT claim_mass_refund')
+                results.append((claim.id, 'failed', err.value))
+            except Exception as err:
+                cr.execute('ROLLBACK TO SAVEPOINT claim_mass_refund')
+                _logger.exception('Refund of the claim %s failed', claim.id)
+                results.append((claim.id, 'failed', tools.ustr(err)))
+            else:
+                cr.execute('RELEASE SAVEPOINT claim_mass_refund')
+                results.append((claim.id, 'done', False))
+        return results
+
+    def _save_results(self, cr, uid, wizard_id, results, context=None):
+        result_obj = self.pool.get('claim.mass.refund.result')
+        for claim_id, state, message in results:
+            result_obj.create(cr, uid,
+                              {'wizard_id': wizard_id,
+                               'claim_id': claim_id,
+                               'state': state,
+                               'message': message},
+                              context=context)
+
+    def _chunk_cursor(self, dbname):
+        return pooler.get_db(dbname).cursor()
+
+    def _refund_chunks(self, dbname, uid, wizard_id, chunks, results,
+                       context=None):
+        """ Refund the chunks of the queue, each one in a new transaction
+        which also saves its results, used as target of the worker
+        threads """
+        while True:
+            try:
+                claim_ids = chunks.get_nowait()
+            except Empty:
+                return
+            cr = self._chunk_cursor(dbname)
+            try:
+                try:
+                    chunk_results = self._refund_claims(cr, uid, claim_ids,
+                                                        context=context)
+                    self._save_results(cr, uid, wizard_id, chunk_results,
+                                       context=context)
+                    cr.commit()
+                except Exception as err:
+                    cr.rollback()
+                    _logger.exception('Refund of the claims %s failed',
+                                      claim_ids)
+                    chunk_results = [(claim_id, 'failed', tools.ustr(err))
+                                     for claim_id in claim_ids]
+                    self._save_results(cr, uid, wizard_id, chunk_results,
+                                       context=context)
+                    cr.commit()
+            finally:
+                cr.close()
+            results.extend(chunk_results)
+
+    def action_refund(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        assert len(ids) == 1, "Only 1 ID expected"
+        wizard = self.browse(cr, uid, ids[0], context=context)
+        claim_ids = [claim.id for claim in wizard.claim_ids]
+        if not claim_ids:
+            raise orm.except_orm(
+                _('Error !'),
+                _('There is no claim to refund.'))
+        chunk_size = max(wizard.chunk_size, 1)
+        chunks = [claim_ids[index:index + chunk_size]
+                  for index in xrange(0, len(claim_ids), chunk_size)]
+        if len(chunks) == 1:
+            results = self._refund_claims(cr, uid, claim_ids,
+                                          context=context)
+            self._save_results(cr, uid, wizard.id, results, context=context)
+        else:
+            results = []
+            queue = Queue()
+            for chunk in chunks:
+                queue.put(chunk)
+            threads = []
+            for __ in xrange(min(max(wizard.workers, 1), len(chunks))):
+                thread = threading.Thread(
+                    target=self._refund_chunks,
+                    args=(cr.dbname, uid, wizard.id, queue, results,
+                          context))
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+        _logger.info('%d claims refunded, %d failures', len(results),
+                     len([result for result in results
+                          if result[1] == 'failed']))
+        self.write(cr, uid, ids, {'state': 'done'}, context=context)
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Mass Refund'),
+            'res_model': self._name,
+            'res_id': ids[0],
+            'view_type': 'form',
+            'view_mode': 'form',
+            'target': 'new',
+            'context': context,
+        }
+
+
+class claim_mass_refund_result(orm.TransientModel):
+
+    _name = 'claim.mass.refund.result'
+    _description = 'Result of the refund of a claim'
+    _order = 'claim_id'
+
+    _columns = {
+        'wizard_id': fields.many2one(
+            'claim.mass.refund',
+            string='Wizard',
+            required=True,
+            ondelete='cascade'),
+        'claim_id': fields.many2one(
+            'crm.claim',
+            string='Claim',
+            readonly=True),
+        'state': fields.selection(
+            [('done', 'Refunded'),
+             ('failed', 'Failed')],
+            string='State',
+            readonly=True),
+        'message': fields.text('Message', readonly=True),
+    }
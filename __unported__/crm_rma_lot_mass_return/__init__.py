@@ -19,4 +19,7 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 ##############################################################################
+from . import prodlot_invoice
+from . import stock
+from . import account_invoice
 from . import wizard
@@ -23,7 +23,8 @@
 {'name': 'RMA Claims Mass Return by Lot',
  'version': '1.0',
  'category': 'Generic Modules/CRM & SRM',
- 'depends': ['crm_claim_rma'
+ 'depends': ['crm_claim_rma',
+             'sale_stock',
              ],
  'author': "Akretion,Odoo Community Association (OCA)",
  'license': 'AGPL-3',
@@ -35,16 +36,18 @@ RMA Claim Mass Return by Lot
 This module adds possibility to return a whole lot of product from a Claim
 and create a incoming shipment for them.
 
-
-WARNING: This module is currently not yet completely debugged and is waiting his author to be.
-
+The customer invoice of each delivered serial / lot number is kept in an
+index, filled when the deliveries are done and when the invoices are
+validated. The returned serial numbers get their invoice line and their
+warranty from it.
 """,
  'images': [],
  'demo': [],
  'data': [
+        'security/ir.model.access.csv',
         'wizard/returned_lines_from_serial_wizard_view.xml',
         'crm_rma_view.xml',
  ],
- 'installable': False,
+ 'installable': True,
  'application': True,
 }
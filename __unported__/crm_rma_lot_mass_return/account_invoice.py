@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#                                                                       #
+#                                                                       #
+#########################################################################
+#                                                                       #
+# Copyright (C) 2009-2011  Akretion, Emmanuel Samyn                     #
+#                                                                       #
+#This program is free software: you can redistribute it and/or modify   #
+#it under the terms of the GNU General Public License as published by   #
+#the Free Software Foundation, either version 3 of the License, or      #
+#(at your option) any later version.                                    #
+#                                                                       #
+#This program is distributed in the hope that it will be useful,        #
+#but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+#GNU General Public License for more details.                           #
+#                                                                       #
+#You should have received a copy of the GNU General Public License      #
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+#########################################################################
+from openerp.osv import orm
+
+
+class account_invoice(orm.Model):
+
+    _inherit = 'account.invoice'
+
+    def invoice_validate(self, cr, uid, ids, context=None):
+        res = super(account_invoice, self).invoice_validate(
+            cr, uid, ids, context=context)
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        index_obj = self.pool.get('stock.prodlot.invoice')
+        index_obj.update_index(cr, uid, invoice_ids=ids, context=context)
+        return res
+
+    def action_cancel(self, cr, uid, ids, context=None):
+        res = super(account_invoice, self).action_cancel(
+            cr, uid, ids, context=context)
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        index_obj = self.pool.get('stock.prodlot.invoice')
+        index_obj.remove_invoices(cr, uid, ids, context=context)
+        return res
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#                                                                       #
+#                                                                       #
+#########################################################################
+#                                                                       #
+# Copyright (C) 2009-2011  Akretion, Emmanuel Samyn                     #
+#                                                                       #
+#This program is free software: you can redistribute it and/or modify   #
+#it under the terms of the GNU General Public License as published by   #
+#the Free Software Foundation, either version 3 of the License, or      #
+#(at your option) any later version.                                    #
+#                                                                       #
+#This program is distributed in the hope that it will be useful,        #
+#but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+#GNU General Public License for more details.                           #
+#                                                                       #
+#You should have received a copy of the GNU General Public License      #
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+#########################################################################
+from openerp import SUPERUSER_ID
+from openerp.osv import fields, orm
+
+
+class stock_prodlot_invoice(orm.Model):
+    """ Last customer invoice line of each serial / lot number by
+    commercial partner
+
+    Filled when the outgoing moves of a sale order are done and when the
+    customer invoices are validated, so the invoice of a returned serial
+    number is found without going through the moves and sale order lines.
+    """
+
+    _name = 'stock.prodlot.invoice'
+    _description = 'Invoice of the serial / lot numbers'
+    _rec_name = 'prodlot_id'
+    _log_access = False
+    _columns = {
+        'prodlot_id': fields.many2one('stock.production.lot',
+                                      'Serial / Lot Number',
+                                      required=True, select=True,
+                                      ondelete='cascade'),
+        'partner_id': fields.many2one('res.partner', 'Commercial Partner',
+                                      required=True, select=True,
+                                      ondelete='cascade'),
+        'invoice_line_id': fields.many2one('account.invoice.line',
+                                           'Invoice Line',
+                                           required=True,
+                                           ondelete='cascade'),
+        'invoice_id': fields.many2one('account.invoice', 'Invoice',
+                                      required=True, select=True,
+                                      ondelete='cascade'),
+        'date_invoice': fields.date('Invoice Date'),
+    }
+
+    _sql_constraints = [
+        ('prodlot_partner_uniq', 'unique(prodlot_id, partner_id)',
+         'A serial / lot number can have only one invoice by '
+         'commercial partner.'),
+    ]
+
+    def init(self, cr):
+        """ Fill the index with the existing moves and invoices """
+        cr.execute("SELECT 1 FROM stock_prodlot_invoice LIMIT 1")
+        if not cr.fetchone():
+            self.update_index(cr, SUPERUSER_ID)
+
+    def update_index(self, cr, uid, move_ids=None, invoice_ids=None,
+                     prodlot_ids=None, context=None):
+        """ Add to the index the invoice lines of the delivered serial /
+        lot numbers, for the moves, the invoices or the serial / lot
+        numbers, or all of them.
+
+        An invoice already indexed for a serial number and a commercial
+        partner is replaced only by a more recent one.
+        """
+        where = []
+        params = []
+        if move_ids is not None:
+            if not move_ids:
+                return True
+            where.append('AND m.id = ANY(%s)')
+            params.append(list(move_ids))
+        if invoice_ids is not None:
+            if not invoice_ids:
+                return True
+            where.append('AND inv.id = ANY(%s)')
+            params.append(list(invoice_ids))
+        if prodlot_ids is not None:
+            if not prodlot_ids:
+                return True
+            where.append('AND m.prodlot_id = ANY(%s)')
+            params.append(list(prodlot_ids))
+        cr.execute("""
+            SELECT DISTINCT ON (m.prodlot_id, inv.commercial_partner_id)
+                   m.prodlot_id, inv.commercial_partner_id, il.id, inv.id,
+                   inv.date_invoice
+            FROM stock_move m
+            JOIN stock_location dest ON dest.id = m.location_dest_id
+            JOIN sale_order_line_invoice_rel rel
+              ON rel.order_line_id = m.sale_line_id
+            JOIN account_invoice_line il ON il.id = rel.invoice_id
+            JOIN account_invoice inv ON inv.id = il.invoice_id
+            WHERE m.prodlot_id IS NOT NULL
+              AND m.state = 'done'
+              AND dest.usage = 'customer'
+              AND inv.type = 'out_invoice'
+              AND inv.state IN ('open', 'paid')
+              %s
+            ORDER BY m.prodlot_id, inv.commercial_partner_id,
+                     inv.date_invoice DESC NULLS LAST, il.id DESC
+            """ % ' '.join(where), params)
+        rows = cr.fetchall()
+        for index in xrange(0, len(rows), 1000):
+            chunk = rows[index:index + 1000]
+            values = ', '.join(['(%s, %s, %s, %s, %s::date)'] * len(chunk))
+            params = [param for row in chunk for param in row]
+            cr.execute("""
+                UPDATE stock_prodlot_invoice t
+                SET invoice_line_id = v.invoice_line_id,
+                    invoice_id = v.invoice_id,
+                    date_invoice = v.date_invoice
+                FROM (VALUES %s) AS v (prodlot_id, partner_id,
+                                       invoice_line_id, invoice_id,
+                                       date_invoice)
+                WHERE t.prodlot_id = v.prodlot_id
+                  AND t.partner_id = v.partner_id
+                  AND (t.date_invoice IS NULL
+                       OR t.date_invoice <= v.date_invoice)
+                """ % values, params)
+            cr.execute("""
+                INSERT INTO stock_prodlot_invoice
+                    (prodlot_id, partner_id, invoice_line_id, invoice_id,
+                     date_invoice)
+                SELECT v.prodlot_id, v.partner_id, v.invoice_line_id,
+                       v.invoice_id, v.date_invoice
+                FROM (VALUES %s) AS v (prodlot_id, partner_id,
+                                       invoice_line_id, invoice_id,
+                                       date_invoice)
+                WHERE NOT EXISTS (SELECT 1 FROM stock_prodlot_invoice t
+                                  WHERE t.prodlot_id = v.prodlot_id
+                                    AND t.partner_id = v.partner_id)
+                """ % values, params)
+        return True
+
+    def remove_invoices(self, cr, uid, invoice_ids, context=None):
+        """ Remove the invoices from the index, their serial / lot numbers
+        get back the last of their remaining valid invoices """
+        if not invoice_ids:
+            return True
+        cr.execute("DELETE FROM stock_prodlot_invoice "
+                   "WHERE invoice_id = ANY(%s) "
+                   "RETURNING prodlot_id",
+                   (list(invoice_ids),))
+        prodlot_ids = list(set(row[0] for row in cr.fetchall()))
+        if prodlot_ids:
+            self.update_index(cr, uid, prodlot_ids=prodlot_ids,
+                              context=context)
+        return True
+
+    def get_invoice_lines(self, cr, uid, prodlot_ids, partner_id=False,
+                          context=None):
+        """ Return the invoice lines of the serial / lot numbers as a dict
+        ``{prodlot_id: (invoice_line_id, invoice_id, date_invoice)}``
+
+        The last invoice of the commercial partner of ``partner_id`` is
+        preferred, then the last invoice of any partner.  Cancelled
+        invoices are ignored.
+        """
+        if not prodlot_ids:
+            return {}
+        if partner_id:
+            partner_obj = self.pool.get('res.partner')
+            partner = partner_obj.browse(cr, uid, partner_id,
+                                         context=context)
+            partner_id = partner.commercial_partner_id.id
+        cr.execute("""
+            SELECT DISTINCT ON (t.prodlot_id)
+                   t.prodlot_id, t.invoice_line_id, t.invoice_id,
+                   t.date_invoice
+            FROM stock_prodlot_invoice t
+            JOIN account_invoice inv ON inv.id = t.invoice_id
+            WHERE t.prodlot_id = ANY(%s)
+              AND inv.state IN ('open', 'paid')
+            ORDER BY t.prodlot_id, t.partner_id = %s DESC,
+                     t.date_invoice DESC NULLS LAST, t.invoice_line_id DESC
+            """, (list(prodlot_ids), partner_id or 0))
+        return dict((row[0], row[1:]) for row in cr.fetchall())
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#                                                                       #
+#                                                                       #
+#########################################################################
+#                                                                       #
+# Copyright (C) 2009-2011  Akretion, Emmanuel Samyn                     #
+#                                                                       #
+#This program is free software: you can redistribute it and/or modify   #
+#it under the terms of the GNU General Public License as published by   #
+#the Free Software Foundation, either version 3 of the License, or      #
+#(at your option) any later version.                                    #
+#                                                                       #
+#This program is distributed in the hope that it will be useful,        #
+#but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+#GNU General Public License for more details.                           #
+#                                                                       #
+#You should have received a copy of the GNU General Public License      #
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+#########################################################################
+from openerp.osv import orm
+
+
+class stock_production_lot(orm.Model):
+
+    _inherit = 'stock.production.lot'
+
+    def get_products(self, cr, uid, ids, context=None):
+        """ Return the products of the lots as a dict
+        ``{prodlot_id: product_id}``
+
+        The product is read on the lots, it is searched in the moves
+        only for the lots without product.
+        """
+        if not ids:
+            return {}
+        lots = self.read(cr, uid, ids, ['product_id'], context=context,
+                         load='_classic_write')
+        res = dict((lot['id'], lot['product_id']) for lot in lots)
+        missing_ids = [lot_id for lot_id, product_id in res.iteritems()
+                       if not product_id]
+        if missing_ids:
+            res.update(self._get_products_from_moves(cr, uid, missing_ids,
+                                                     context=context))
+        return res
+
+    def _get_products_from_moves(self, cr, uid, ids, context=None):
+        """ Return the product of the last move of each lot """
+        cr.execute("SELECT DISTINCT ON (prodlot_id) prodlot_id, product_id "
+                   "FROM stock_move "
+                   "WHERE prodlot_id IN %s "
+                   "ORDER BY prodlot_id, date DESC, id DESC",
+                   (tuple(ids),))
+        return dict(cr.fetchall())
+
+
+class stock_move(orm.Model):
+
+    _inherit = 'stock.move'
+
+    def action_done(self, cr, uid, ids, context=None):
+        res = super(stock_move, self).action_done(cr, uid, ids,
+                                                  context=context)
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        index_obj = self.pool.get('stock.prodlot.invoice')
+        index_obj.update_index(cr, uid, move_ids=ids, context=context)
+        return res
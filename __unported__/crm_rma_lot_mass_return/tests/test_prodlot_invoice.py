@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#                                                                       #
+#                                                                       #
+#########################################################################
+#                                                                       #
+# Copyright (C) 2009-2011  Akretion, Emmanuel Samyn                     #
+#                                                                       #
+#This program is free software: you can redistribute it and/or modify   #
+#it under the terms of the GNU General Public License as published by   #
+#the Free Software Foundation, either version 3 of the License, or      #
+#(at your option) any later version.                                    #
+#                                                                       #
+#This program is distributed in the hope that it will be useful,        #
+#but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+#GNU General Public License for more details.                           #
+#                                                                       #
+#You should have received a copy of the GNU General Public License      #
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+#########################################################################
+from openerp import netsvc
+from openerp.tests import common
+
+
+class test_prodlot_invoice(common.TransactionCase):
+    """ Test the index of the invoices of the serial numbers """
+
+    def setUp(self):
+        super(test_prodlot_invoice, self).setUp()
+        cr, uid = self.cr, self.uid
+
+        self.Invoice = self.registry('account.invoice')
+        self.Index = self.registry('stock.prodlot.invoice')
+        Lot = self.registry('stock.production.lot')
+        Move = self.registry('stock.move')
+        SaleOrder = self.registry('sale.order')
+
+        self.product_id = self.ref('product.product_product_4')
+        self.partner_id = self.ref('base.res_partner_12')
+        order_id = SaleOrder.create(
+            cr, uid,
+            {'partner_id': self.partner_id,
+             'partner_invoice_id': self.partner_id,
+             'partner_shipping_id': self.partner_id,
+             'pricelist_id': self.ref('product.list0'),
+             'order_line': [
+                 (0, 0, {'name': 'TEST ORDER LINE',
+                         'product_id': self.product_id,
+                         'product_uom_qty': 1,
+                         'price_unit': 100,
+                         })],
+             })
+        order = SaleOrder.browse(cr, uid, order_id)
+        self.order_line = order.order_line[0]
+        self.prodlot_id = Lot.create(cr, uid,
+                                     {'name': 'TEST SERIAL 1',
+                                      'product_id': self.product_id})
+        self.move_id = Move.create(
+            cr, uid,
+            {'name': 'TEST MOVE',
+             'product_id': self.product_id,
+             'product_qty': 1,
+             'product_uom': self.ref('product.product_uom_unit'),
+             'prodlot_id': self.prodlot_id,
+             'sale_line_id': self.order_line.id,
+             'location_id': self.ref('stock.stock_location_stock'),
+             'location_dest_id': self.ref('stock.stock_location_customers'),
+             'state': 'done',
+             })
+
+    def _invoice(self, date_invoice, partner_id=None):
+        """ Create and open an invoice of the sale order line """
+        cr, uid = self.cr, self.uid
+        invoice_id = self.Invoice.create(
+            cr, uid,
+            {'partner_id': partner_id or self.partner_id,
+             'account_id': self.ref('account.a_recv'),
+             'type': 'out_invoice',
+             'date_invoice': date_invoice,
+             'invoice_line': [
+                 (0, 0, {'name': 'TEST INVOICE LINE',
+                         'product_id': self.product_id,
+                         'account_id': self.ref('account.a_sale'),
+                         'quantity': 1,
+                         'price_unit': 100,
+                         })],
+             },
+            context={'type': 'out_invoice'})
+        invoice = self.Invoice.browse(cr, uid, invoice_id)
+        self.order_line.write(
+            {'invoice_lines': [(4, invoice.invoice_line[0].id)]})
+        wf_service = netsvc.LocalService('workflow')
+        wf_service.trg_validate(uid, 'account.invoice', invoice_id,
+                                'invoice_open', cr)
+        return invoice_id
+
+    def _indexed_invoice(self, partner_id=None):
+        invoice_lines = self.Index.get_invoice_lines(
+            self.cr, self.uid, [self.prodlot_id],
+            partner_id=partner_id or self.partner_id)
+        return invoice_lines[self.prodlot_id][1]
+
+    def test_index(self):
+        """ The last validated invoice of a serial number is indexed """
+        cr, uid = self.cr, self.uid
+        self._invoice('2014-01-31')
+        invoice_id = self._invoice('2014-03-31')
+        self.assertEquals(self._indexed_invoice(), invoice_id)
+        index_ids = self.Index.search(cr, uid,
+                                      [('prodlot_id', '=', self.prodlot_id)])
+        self.assertEquals(len(index_ids), 1)
+
+    def test_cancel(self):
+        """ A cancelled invoice is replaced by the previous valid one """
+        cr, uid = self.cr, self.uid
+        invoice_id = self._invoice('2014-01-31')
+        last_invoice_id = self._invoice('2014-03-31')
+        last_invoice = self.Invoice.browse(cr, uid, last_invoice_id)
+        last_invoice.journal_id.write({'update_posted': True})
+        self.Invoice.action_cancel(cr, uid, [last_invoice_id])
+        self.assertEquals(self._indexed_invoice(), invoice_id)
+
+    def test_contact(self):
+        """ The invoices of the contacts are indexed on their company """
+        cr, uid = self.cr, self.uid
+        Partner = self.registry('res.partner')
+        contact_id = Partner.create(cr, uid,
+                                    {'name': 'TEST CONTACT',
+                                     'parent_id': self.partner_id})
+        invoice_id = self._invoice('2014-01-31', partner_id=contact_id)
+        self.assertEquals(self._indexed_invoice(), invoice_id)
+        self.assertEquals(self._indexed_invoice(partner_id=contact_id),
+                          invoice_id)
+        index_ids = self.Index.search(cr, uid,
+                                      [('prodlot_id', '=', self.prodlot_id),
+                                       ('partner_id', '=', self.partner_id)])
+        self.assertEquals(len(index_ids), 1)
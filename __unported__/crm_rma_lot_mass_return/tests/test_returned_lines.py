@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#                                                                       #
+#                                                                       #
+#########################################################################
+#                                                                       #
+# Copyright (C) 2009-2011  Akretion, Emmanuel Samyn                     #
+#                                                                       #
+#This program is free software: you can redistribute it and/or modify   #
+#it under the terms of the GNU General Public License as published by   #
+#the Free Software Foundation, either version 3 of the License, or      #
+#(at your option) any later version.                                    #
+#                                                                       #
+#This program is distributed in the hope that it will be useful,        #
+#but WITHOUT ANY WARRANTY; without even the implied warranty of         #
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the          #
+#GNU General Public License for more details.                           #
+#                                                                       #
+#You should have received a copy of the GNU General Public License      #
+#along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
+#########################################################################
+from openerp import netsvc
+from openerp.osv import orm
+from openerp.tests import common
+
+
+class test_returned_lines(common.TransactionCase):
+    """ Test the creation of the claim lines from serial numbers """
+
+    def setUp(self):
+        super(test_returned_lines, self).setUp()
+        cr, uid = self.cr, self.uid
+
+        self.Wizard = self.registry('returned_lines_from_serial.wizard')
+        self.Lot = self.registry('stock.production.lot')
+        Claim = self.registry('crm.claim')
+        Invoice = self.registry('account.invoice')
+        Move = self.registry('stock.move')
+        SaleOrder = self.registry('sale.order')
+
+        self.product_id = self.ref('product.product_product_4')
+        self.partner_id = self.ref('base.res_partner_12')
+        order_id = SaleOrder.create(
+            cr, uid,
+            {'partner_id': self.partner_id,
+             'partner_invoice_id': self.partner_id,
+             'partner_shipping_id': self.partner_id,
+             'pricelist_id': self.ref('product.list0'),
+             'order_line': [
+                 (0, 0, {'name': 'TEST ORDER LINE',
+                         'product_id': self.product_id,
+                         'product_uom_qty': 2,
+                         'price_unit': 100,
+                         })],
+             })
+        order_line = SaleOrder.browse(cr, uid, order_id).order_line[0]
+        self.prodlot_ids = []
+        self.move_ids = []
+        for name in ('TEST SERIAL 1', 'TEST SERIAL 2'):
+            prodlot_id = self.Lot.create(cr, uid,
+                                         {'name': name,
+                                          'product_id': self.product_id})
+            self.prodlot_ids.append(prodlot_id)
+            self.move_ids.append(Move.create(
+                cr, uid,
+                {'name': 'TEST MOVE',
+                 'product_id': self.product_id,
+                 'product_qty': 1,
+                 'product_uom': self.ref('product.product_uom_unit'),
+                 'prodlot_id': prodlot_id,
+                 'sale_line_id': order_line.id,
+                 'location_id': self.ref('stock.stock_location_stock'),
+                 'location_dest_id': self.ref(
+                     'stock.stock_location_customers'),
+                 'state': 'done',
+                 }))
+        self.invoice_id = Invoice.create(
+            cr, uid,
+            {'partner_id': self.partner_id,
+             'account_id': self.ref('account.a_recv'),
+             'type': 'out_invoice',
+             'date_invoice': '2014-01-31',
+             'invoice_line': [
+                 (0, 0, {'name': 'TEST INVOICE LINE',
+                         'product_id': self.product_id,
+                         'account_id': self.ref('account.a_sale'),
+                         'quantity': 2,
+                         'price_unit': 100,
+                         })],
+             },
+            context={'type': 'out_invoice'})
+        invoice = Invoice.browse(cr, uid, self.invoice_id)
+        self.invoice_line_id = invoice.invoice_line[0].id
+        order_line.write({'invoice_lines': [(4, self.invoice_line_id)]})
+        wf_service = netsvc.LocalService('workflow')
+        wf_service.trg_validate(uid, 'account.invoice', self.invoice_id,
+                                'invoice_open', cr)
+        self.claim_id = Claim.create(
+            cr, uid,
+            {'name': 'TEST CLAIM',
+             'claim_type': 'customer',
+             'partner_id': self.partner_id,
+             })
+        self.context = {'active_id': self.claim_id}
+
+    def _add_return_lines(self, values):
+        cr, uid = self.cr, self.uid
+        wizard_id = self.Wizard.create(cr, uid, values,
+                                       context=self.context)
+        self.Wizard.add_return_lines(cr, uid, [wizard_id],
+                                     context=self.context)
+
+    def test_several_serials(self):
+        """ One line is created for each serial number """
+        cr, uid = self.cr, self.uid
+        self._add_return_lines(
+            {'serials': 'TEST SERIAL 1\nTEST SERIAL 2\r\nTEST SERIAL 1\n'})
+        claim = self.registry('crm.claim').browse(cr, uid, self.claim_id)
+        lines = dict((line.prodlot_id.id, line)
+                     for line in claim.claim_line_ids)
+        self.assertEquals(sorted(lines), sorted(self.prodlot_ids))
+        for line in lines.itervalues():
+            self.assertEquals(line.product_id.id, self.product_id)
+            self.assertEquals(line.invoice_line_id.id, self.invoice_line_id)
+            self.assertEquals(line.unit_sale_price, 100)
+
+    def test_unknown_serial(self):
+        """ The unknown serial numbers are refused """
+        with self.assertRaises(orm.except_orm):
+            self._add_return_lines(
+                {'serials': 'TEST SERIAL 1\nTEST UNKNOWN SERIAL'})
+
+    def test_products_of_lots(self):
+        """ The product of a serial number is read on its lot """
+        cr, uid = self.cr, self.uid
+        other_product_id = self.ref('product.product_product_5')
+        self.Lot.write(cr, uid, [self.prodlot_ids[1]],
+                       {'product_id': other_product_id})
+        products = self.Lot.get_products(cr, uid, self.prodlot_ids)
+        self.assertEquals(products, {self.prodlot_ids[0]: self.product_id,
+                                     self.prodlot_ids[1]: other_product_id})
+        self._add_return_lines({'serials': 'TEST SERIAL 2'})
+        claim = self.registry('crm.claim').browse(cr, uid, self.claim_id)
+        self.assertEquals(claim.claim_line_ids[0].product_id.id,
+                          other_product_id)
+
+    def test_invoice_of_moves(self):
+        """ The invoice lines of the moves are found at once """
+        cr, uid = self.cr, self.uid
+        expected = [(self.invoice_line_id, self.invoice_id)]
+        self.assertEquals(
+            self.Wizard.stock_move_2_invoice_lines(
+                cr, uid, stock_move_ids=self.move_ids),
+            expected)
+        self.assertEquals(
+            self.Wizard.stock_move_2_invoice_lines(
+                cr, uid, prodlot_ids=self.prodlot_ids),
+            expected)
+        self.assertEquals(
+            self.Wizard.stock_move_2_invoice(cr, uid, self.move_ids),
+            [self.invoice_id])
+        self.assertEquals(self.Wizard.stock_move_2_invoice_lines(cr, uid),
+                          [])
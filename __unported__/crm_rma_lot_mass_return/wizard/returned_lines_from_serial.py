@@ -19,7 +19,10 @@
 #You should have received a copy of the GNU General Public License      #
 #along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
 #########################################################################
+import re
+
 from openerp.osv import fields, orm
+from openerp.tools.translate import _
 
 
 class returned_lines_from_serial(orm.TransientModel):
@@ -27,103 +30,62 @@ class returned_lines_from_serial(orm.TransientModel):
     _name = 'returned_lines_from_serial.wizard'
     _description = 'Wizard to create product return lines from serial numbers'
     _columns = {
-        'prodlot_id_1': fields.many2one('stock.production.lot',
-            'Serial / Lot Number 1', required=True),
-        'prodlot_id_2': fields.many2one('stock.production.lot',
-            'Serial / Lot Number 2'),
-        'prodlot_id_3': fields.many2one('stock.production.lot',
-            'Serial / Lot Number 3'),
-        'prodlot_id_4': fields.many2one('stock.production.lot',
-            'Serial / Lot Number 4'),
-        'prodlot_id_5': fields.many2one('stock.production.lot',
-            'Serial / Lot Number 5'),
-        'qty_1' : fields.float('Quantity 1', digits=(12,2), required=True),
-        'qty_2' : fields.float('Quantity 2', digits=(12,2)),
-        'qty_3' : fields.float('Quantity 3', digits=(12,2)),
-        'qty_4' : fields.float('Quantity 4', digits=(12,2)),
-        'qty_5' : fields.float('Quantity 5', digits=(12,2)),
-        'claim_1': fields.selection([('none','Not specified'),
-                                    ('legal','Legal retractation'),
-                                    ('cancellation','Order cancellation'),
-                                    ('damaged','Damaged delivered product'),                                    
-                                    ('error','Shipping error'),
-                                    ('exchange','Exchange request'),
-                                    ('lost','Lost during transport'),
-                                    ('other','Other')], 'Claim Subject',
-                                    required=True,
-                                    help="To describe the product problem"),  
-        'claim_2': fields.selection([('none','Not specified'),
-                                    ('legal','Legal retractation'),
-                                    ('cancellation','Order cancellation'),
-                                    ('damaged','Damaged delivered product'),                                    
-                                    ('error','Shipping error'),
-                                    ('exchange','Exchange request'),
-                                    ('lost','Lost during transport'),
-                                    ('other','Other')], 'Claim Subject',
-                                    required=True,
-                                    help="To describe the line product problem"),
-        'claim_3': fields.selection([('none','Not specified'),
-                                    ('legal','Legal retractation'),
-                                    ('cancellation','Order cancellation'),
-                                    ('damaged','Damaged delivered product'),                                    
-                                    ('error','Shipping error'),
-                                    ('exchange','Exchange request'),
-                                    ('lost','Lost during transport'),
-                                    ('other','Other')], 'Claim Subject',
-                                    required=True,
-                                    help="To describe the line product problem"),
-        'claim_4': fields.selection([('none','Not specified'),
-                                    ('legal','Legal retractation'),
-                                    ('cancellation','Order cancellation'),
-                                    ('damaged','Damaged delivered product'),                                    
-                                    ('error','Shipping error'),
-                                    ('exchange','Exchange request'),
-                                    ('lost','Lost during transport'),
-                                    ('other','Other')], 'Claim Subject',
-                                    required=True,
-                                    help="To describe the line product problem"),
-        'claim_5': fields.selection([('none','Not specified'),
-                                    ('legal','Legal retractation'),
-                                    ('cancellation','Order cancellation'),
-                                    ('damaged','Damaged delivered product'),                                    
-                                    ('error','Shipping error'),
-                                    ('exchange','Exchange request'),
-                                    ('lost','Lost during transport'),
-                                    ('other','Other')], 'Claim Subject',
-                                    required=True,
-                                    help="To describe the line product problem"),
+        'serials': fields.text(
+            'Serial / Lot Numbers',
+            help="Serial or lot numbers of the returned products, pasted or "
+                 "scanned, one by line."),
+        'prodlot_ids': fields.many2many(
+            'stock.production.lot',
+            'returned_lines_from_serial_prodlot_rel',
+            'wizard_id',
+            'prodlot_id',
+            string='Serial / Lot Numbers'),
+        'qty': fields.float('Quantity', digits=(12, 2), required=True,
+                            help="Quantity returned for each serial / lot "
+                                 "number"),
+        'claim_origine': fields.selection([('none', 'Not specified'),
+                                           ('legal', 'Legal retractation'),
+                                           ('cancellation',
+                                            'Order cancellation'),
+                                           ('damaged',
+                                            'Damaged delivered product'),
+                                           ('error', 'Shipping error'),
+                                           ('exchange', 'Exchange request'),
+                                           ('lost', 'Lost during transport'),
+                                           ('other', 'Other')],
+                                          'Claim Subject',
+                                          required=True,
+                                          help="To describe the line product "
+                                               "problem"),
         'partner_id': fields.many2one('res.partner', 'Partner'),
     }
-    
+
     # Get partner from case is set to filter serials
-    def _get_default_partner_id(self, cr, uid, context):
-        return self.pool.get('crm.claim').read(cr, uid,
-            context['active_id'], ['partner_id'])['partner_id'][0]    
+    def _get_default_partner_id(self, cr, uid, context=None):
+        if not (context and context.get('active_id')):
+            return False
+        claim = self.pool.get('crm.claim').read(cr, uid,
+                                                context['active_id'],
+                                                ['partner_id'],
+                                                context=context)
+        return claim['partner_id'] and claim['partner_id'][0]
 
     _defaults = {
-        'qty_1': lambda *a: 1.0,
-        'qty_2': lambda *a: 1.0,
-        'qty_3': lambda *a: 1.0,
-        'qty_4': lambda *a: 1.0,
-        'qty_5': lambda *a: 1.0,
-        'claim_1': lambda *a: "none",
-        'claim_2': lambda *a: "none",
-        'claim_3': lambda *a: "none",
-        'claim_4': lambda *a: "none",
-        'claim_5': lambda *a: "none",
+        'qty': 1.0,
+        'claim_origine': 'none',
         'partner_id': _get_default_partner_id,
     }
-    
+
     # If "Cancel" button pressed
-    def action_cancel(self,cr,uid,ids,conect=None):
-        return {'type': 'ir.actions.act_window_close',}
-    
+    def action_cancel(self, cr, uid, ids, context=None):
+        return {'type': 'ir.actions.act_window_close'}
+
     # If "Add & close" button pressed
     def action_add_and_close(self, cr, uid, ids, context=None):
-        self.add_return_lines(cr, uid, ids, context)    
-        return {'type': 'ir.actions.act_window_close',}
-    
-    # If "Add & new" button pressed    
+        self.add_return_lines(cr, uid, ids, context)
+        return {'type': 'ir.actions.act_window_close'}
+
+    # If "Add & new" button pressed
     def action_add_and_new(self, cr, uid, ids, context=None):
         self.add_return_lines(cr, uid, ids, context)
         return {
@@ -135,133 +97,160 @@ class returned_lines_from_serial(orm.TransientModel):
             'type': 'ir.actions.act_window',
             'target': 'new',
         }
-    
-    # Method to get the product id from set
-    def get_product_id(self, cr, uid,ids,product_set, context=None):
-        product_id = False
-        for product in self.prodlot_2_product(cr, uid,[product_set]):
-            product_id = product
-        return product_id
+
+    @staticmethod
+    def _parse_serials(serials):
+        """ Return the serial numbers of a pasted or scanned text, one by
+        line (commas and semicolons are accepted too), in their order """
+        if not serials:
+            return []
+        names = (name.strip() for name in re.split(r'[\r\n,;]+', serials))
+        return [name for name in names if name]
+
+    def _get_prodlots(self, cr, uid, names, prodlot_ids, context=None):
+        """ Return the lots of the serial numbers and of the selected lots
+        with their product, as a list of ``(prodlot_id, product_id)``
+        resolved with a single query.  The moves are searched only for the
+        lots without product.
+
+        Raise an error listing the serial numbers which do not exist or
+        match several lots.
+        """
+        cr.execute("SELECT id, name, product_id "
+                   "FROM stock_production_lot "
+                   "WHERE name IN %s OR id IN %s",
+                   (tuple(names) or (None,), tuple(prodlot_ids) or (None,)))
+        rows = cr.fetchall()
+        by_name = {}
+        products = {}
+        for prodlot_id, name, product_id in rows:
+            by_name.setdefault(name, []).append(prodlot_id)
+            products[prodlot_id] = product_id
+        missing = [name for name in names if name not in by_name]
+        ambiguous = [name for name in names if len(by_name.get(name, [])) > 1]
+        if missing or ambiguous:
+            message = []
+            if missing:
+                message.append(_('Unknown serial / lot numbers: %s') %
+                               ', '.join(missing))
+            if ambiguous:
+                message.append(_('Serial / lot numbers matching several '
+                                 'lots: %s') % ', '.join(ambiguous))
+            raise orm.except_orm(_('Error'), '\n'.join(message))
+        missing_ids = [prodlot_id for prodlot_id, product_id
+                       in products.iteritems() if not product_id]
+        if missing_ids:
+            lot_obj = self.pool.get('stock.production.lot')
+            products.update(lot_obj._get_products_from_moves(
+                cr, uid, missing_ids, context=context))
+        # a serial number scanned twice is returned once
+        prodlots = []
+        for prodlot_id in [by_name[name][0] for name in names] + prodlot_ids:
+            if prodlot_id not in products:
+                continue
+            prodlots.append((prodlot_id, products.pop(prodlot_id)))
+        return prodlots
 
     # Method to create return lines
     def add_return_lines(self, cr, uid, ids, context=None):
-        result = self.browse(cr,uid,ids)[0]
-        return_line = self.pool.get('claim.line')
-        # Refactor code : create 1 "createmethode" called by each if with values as parameters    
-        return_line.create(cr, uid, {
-                    'claim_id': context['active_id'],
-                    'claim_origine': result.claim_1,
-                    'product_id' : self.get_product_id(cr, uid, ids,
-                        result.prodlot_id_1.id, context=context),
-                    #'invoice_id' : self.prodlot_2_invoice(cr, uid,[result.prodlot_id_1.id],[result.prodlot_id_1.product_id.id]), #PRODLOT_ID can be in many invoice !!
-                    'product_returned_quantity' : result.qty_1,
-                    'prodlot_id' : result.prodlot_id_1.id,
-					'selected' : False,		
-					'state' : 'draft',                    
-					#'guarantee_limit' : warranty['value']['guarantee_limit'],
-					#'warning' : warranty['value']['warning'],
-               }) 
-        if result.prodlot_id_2.id : 
-            return_line.create(cr, uid, {
-                    'claim_id': context['active_id'],
-                    'claim_origine': result.claim_2,
-                    'product_id' : self.get_product_id(cr, uid, ids,
-                        result.prodlot_id_2.id, context=context),
-#                    'invoice_id' : self.prodlot_2_invoice(cr, uid,[result.prodlot_id_1.id]),
-                    'product_returned_quantity' : result.qty_2,
-                    'prodlot_id' : result.prodlot_id_2.id,
-					'selected' : False,		
-					'state' : 'draft',                    
-					#'guarantee_limit' : warranty['value']['guarantee_limit'],
-					#'warning' : warranty['value']['warning'],
-               })
-        if result.prodlot_id_3.id : 
-            return_line.create(cr, uid, {
-                    'claim_id': context['active_id'],
-                    'claim_origine': result.claim_3,
-                    'product_id' : self.get_product_id(cr, uid, ids,
-                        result.prodlot_id_3.id, context=context),
-#                    'invoice_id' : self.prodlot_2_invoice(cr, uid,[result.prodlot_id_1.id]),
-                    'product_returned_quantity' : result.qty_3,
-                    'prodlot_id' : result.prodlot_id_3.id,
-                    'selected' : False,		
-					'state' : 'draft', 
-					#'guarantee_limit' : warranty['value']['guarantee_limit'],
-					#'warning' : warranty['value']['warning'],
-               })
-        if result.prodlot_id_4.id : 
-            return_line.create(cr, uid, {
-                    'claim_id': context['active_id'],
-                    'claim_origine': result.claim_4,
-                    'product_id' : self.get_product_id(cr, uid, ids,
-                        result.prodlot_id_4.id, context=context),
-#                    'invoice_id' : self.prodlot_2_invoice(cr, uid,[result.prodlot_id_1.id]),
-                    'product_returned_quantity' : result.qty_4,
-                    'prodlot_id' : result.prodlot_id_4.id,
-                    'selected' : False,		
-					'state' : 'draft', 
-					#'guarantee_limit' : warranty['value']['guarantee_limit'],
-					#'warning' : warranty['value']['warning'],
-               })
-        if result.prodlot_id_5.id : 
-            return_line.create(cr, uid, {
-                    'claim_id': context['active_id'],
-                    'claim_origine': result.claim_5,
-                    'product_id' : self.get_product_id(cr, uid, ids,
-                        result.prodlot_id_5.id, context=context),
-#                    'invoice_id' : self.prodlot_2_invoice(cr, uid,[result.prodlot_id_1.id],[result.prodlot_id_1.product_id.id]),
-                    'product_returned_quantity' : result.qty_5,
-                    'prodlot_id' : result.prodlot_id_5.id,
-                    'selected' : False,		
-					'state' : 'draft', 
-					#'guarantee_type':
-					#'guarantee_limit' : warranty['value']['guarantee_limit'],
-					#'warning' : warranty['value']['warning'],					
-               })  					
-					                 
-        return True
-        
-    def prodlot_2_product(self,cr, uid, prodlot_ids):          
-        stock_move_ids = self.pool.get('stock.move').search(cr, uid, 
-            [('prodlot_id', 'in', prodlot_ids)])
-        res = self.pool.get('stock.move').read(cr, uid, 
-            stock_move_ids, ['product_id'])
-        return set([x['product_id'][0] for x in res if x['product_id']])
-        
-    def prodlot_2_invoice(self,cr, uid, prodlot_id,product_id):
-        # get stock_move_ids
-        stock_move_ids = self.pool.get('stock.move').search(cr, uid,
-            [('prodlot_id', 'in', prodlot_id)])
-        # if 1 id
-            # (get stock picking (filter on out ?))
-            # get invoice_ids from stock_move_id where invoice.line.product = prodlot_product and invoice customer = claim_partner
-            # if 1 id
-                # return invoice_id
-            # else
-        # else : move_in / move_out ; 1 move per order line so if many order lines with same lot, ...
-        
-        
-        #
-        #return set(self.stock_move_2_invoice(cr, uid, stock_move_ids))
+        """ Create one return line by serial / lot number, all at once,
+        with the invoice line of the serial number and its warranty """
+        result = self.browse(cr, uid, ids, context=context)[0]
+        claim_obj = self.pool.get('crm.claim')
+        claim_line_obj = self.pool.get('claim.line')
+        inv_line_obj = self.pool.get('account.invoice.line')
+        claim_id = context['active_id']
+        names = self._parse_serials(result.serials)
+        prodlot_ids = [prodlot.id for prodlot in result.prodlot_ids]
+        if not (names or prodlot_ids):
+            raise orm.except_orm(
+                _('Error'),
+                _('Please enter or select the serial / lot numbers.'))
+        prodlots = self._get_prodlots(cr, uid, names, prodlot_ids,
+                                      context=context)
+        invoice_lines = self.prodlot_2_invoice(
+            cr, uid, [prodlot_id for prodlot_id, __ in prodlots],
+            result.partner_id.id, context=context)
+        prices = {}
+        if invoice_lines:
+            prices = dict(
+                (inv_line['id'], inv_line['price_unit']) for inv_line
+                in inv_line_obj.read(cr, uid,
+                                     list(set(invoice_lines.itervalues())),
+                                     ['price_unit'], context=context))
+        lines = []
+        for prodlot_id, product_id in prodlots:
+            invoice_line_id = invoice_lines.get(prodlot_id, False)
+            lines.append((0, 0, {
+                'claim_origine': result.claim_origine,
+                'product_id': product_id,
+                'product_returned_quantity': result.qty,
+                'prodlot_id': prodlot_id,
+                'invoice_line_id': invoice_line_id,
+                'unit_sale_price': prices.get(invoice_line_id, 0.0),
+                'state': 'draft',
+            }))
+        line_ids = claim_line_obj.search(cr, uid,
+                                         [('claim_id', '=', claim_id)],
+                                         context=context)
+        claim_obj.write(cr, uid, [claim_id],
+                        {'claim_line_ids': lines}, context=context)
+        new_line_ids = claim_line_obj.search(
+            cr, uid,
+            [('claim_id', '=', claim_id),
+             ('id', 'not in', line_ids),
+             ('invoice_line_id', '!=', False)],
+            context=context)
+        # the lines whose warranty cannot be computed are left as is
+        values, __ = claim_line_obj._get_warranty_values_batch(
+            cr, uid, new_line_ids, context=context)
+        claim_line_obj._write_grouped(cr, uid, values, context=context)
         return True
 
-    def stock_move_2_invoice(self, cr, uid, stock_move_ids):
-        inv_line_ids = []
-        res = self.pool.get('stock.move').read(cr, uid,
-            stock_move_ids, ['sale_line_id'])
-        sale_line_ids = [x['sale_line_id'][0] for x in res if x['sale_line_id']]
-        if not sale_line_ids:
-            return []
-        sql_base = "select invoice_id from sale_order_line_invoice_rel where \
-         order_line_id in ("
-        cr.execute(sql_base + ','.join(map(lambda x: str(x),sale_line_ids))+')')
-        res = cr.fetchall()     
-        for i in res:
-            for j in i:
-                inv_line_ids.append(j)
+    def prodlot_2_product(self, cr, uid, prodlot_ids):
+        lot_obj = self.pool.get('stock.production.lot')
+        products = lot_obj.get_products(cr, uid, prodlot_ids)
+        return set(product_id for product_id in products.itervalues()
+                   if product_id)
 
-        res = self.pool.get('account.invoice.line').read(cr, uid,
-            inv_line_ids,['invoice_id'])
-        return [x['invoice_id'][0] for x in res if x['invoice_id']]  
+    def prodlot_2_invoice(self, cr, uid, prodlot_ids, partner_id=False,
+                          context=None):
+        """ Return the customer invoice lines of the serial / lot numbers,
+        preferably the ones of the partner, as a dict
+        ``{prodlot_id: invoice_line_id}`` """
+        index_obj = self.pool.get('stock.prodlot.invoice')
+        invoice_lines = index_obj.get_invoice_lines(
+            cr, uid, prodlot_ids, partner_id=partner_id, context=context)
+        return dict((prodlot_id, values[0]) for prodlot_id, values
+                    in invoice_lines.iteritems())
 
-             
\ No newline at end of file
+    def stock_move_2_invoice_lines(self, cr, uid, stock_move_ids=None,
+                                   prodlot_ids=None, context=None):
+        """ Return the invoice lines of the sale order lines of the moves,
+        or of the moves of the serial / lot numbers, as a list of
+        ``(invoice_line_id, invoice_id)``
+
+        The ids are passed as arrays, so the query does not grow with the
+        number of moves.
+        """
+        if stock_move_ids:
+            where = 'm.id = ANY(%s)'
+            param = list(stock_move_ids)
+        elif prodlot_ids:
+            where = 'm.prodlot_id = ANY(%s)'
+            param = list(prodlot_ids)
+        else:
+            return []
+        cr.execute("SELECT DISTINCT il.id, il.invoice_id "
+                   "FROM stock_move m "
+                   "JOIN sale_order_line_invoice_rel rel "
+                   "  ON rel.order_line_id = m.sale_line_id "
+                   "JOIN account_invoice_line il ON il.id = rel.invoice_id "
+                   "WHERE " + where,
+                   (param,))
+        return cr.fetchall()
+
+    def stock_move_2_invoice(self, cr, uid, stock_move_ids):
+        invoice_lines = self.stock_move_2_invoice_lines(
+            cr, uid, stock_move_ids=stock_move_ids)
+        return list(set(invoice_id for __, invoice_id in invoice_lines))
@@ -19,5 +19,10 @@
 #
 ##############################################################################
 
+from . import stock_rma_snapshot
 from . import stock_warehouse
+from . import stock_location
+from . import stock_move
 from . import product
+from . import ir_config_parameter
+from . import res_users
@@ -36,13 +36,24 @@ A RMA location can be selected on the warehouses.
 The product views displays the quantity available and virtual in this
  RMA location (including the children locations).
 
+For large volumes of moves, the RMA quantities can be maintained by
+product and warehouse in a snapshot, updated with the moves. It is
+enabled by setting the system parameter
+``crm_rma_stock_location.snapshot`` to ``1``. The daily scheduled
+action 'Rebuild and verify the RMA stock snapshot' builds it again from
+the moves, merges the differences added by the moves and logs the
+differences with the live computation.
+
  """,
  'website': 'http://www.camptocamp.com',
- 'data': ['stock_data.xml',
+ 'data': ['security/ir.model.access.csv',
+          'stock_data.xml',
+          'stock_rma_snapshot_data.xml',
           'stock_warehouse_view.xml',
           'product_view.xml',
           ],
  'test': ['test/quantity.yml',
+          'test/snapshot.yml',
           ],
  'installable': True,
  'auto_install': False,
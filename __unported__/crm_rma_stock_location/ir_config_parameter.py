@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Author: Guewen Baconnier
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp import SUPERUSER_ID
+from openerp.osv import orm
+
+from .stock_rma_snapshot import SNAPSHOT_PARAMETER
+
+
+class IrConfigParameter(orm.Model):
+    _inherit = 'ir.config_parameter'
+
+    def _snapshot_changed(self, cr, uid, was_enabled, context=None):
+        snapshot_obj = self.pool['stock.rma.snapshot']
+        snapshot_obj.is_enabled.clear_cache(snapshot_obj)
+        if not was_enabled and snapshot_obj.is_enabled(cr, uid):
+            snapshot_obj.rebuild(cr, uid, verify=False, context=context)
+
+    def create(self, cr, uid, vals, context=None):
+        snapshot_obj = self.pool['stock.rma.snapshot']
+        was_enabled = snapshot_obj.is_enabled(cr, uid)
+        res = super(IrConfigParameter, self).create(cr, uid, vals,
+                                                    context=context)
+        if vals.get('key') == SNAPSHOT_PARAMETER:
+            self._snapshot_changed(cr, uid, was_enabled, context=context)
+        return res
+
+    def _has_snapshot_parameter(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        return bool(self.search(cr, SUPERUSER_ID,
+                                [('id', 'in', ids),
+                                 ('key', '=', SNAPSHOT_PARAMETER)],
+                                context=context))
+
+    def write(self, cr, uid, ids, vals, context=None):
+        # clearing an ormcache clears all the caches of the workers, only
+        # do it for the snapshot parameter
+        if not (vals.get('key') == SNAPSHOT_PARAMETER or
+                self._has_snapshot_parameter(cr, uid, ids,
+                                             context=context)):
+            return super(IrConfigParameter, self).write(cr, uid, ids, vals,
+                                                        context=context)
+        snapshot_obj = self.pool['stock.rma.snapshot']
+        was_enabled = snapshot_obj.is_enabled(cr, uid)
+        res = super(IrConfigParameter, self).write(cr, uid, ids, vals,
+                                                   context=context)
+        self._snapshot_changed(cr, uid, was_enabled, context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        if not self._has_snapshot_parameter(cr, uid, ids, context=context):
+            return super(IrConfigParameter, self).unlink(cr, uid, ids,
+                                                         context=context)
+        res = super(IrConfigParameter, self).unlink(cr, uid, ids,
+                                                    context=context)
+        snapshot_obj = self.pool['stock.rma.snapshot']
+        snapshot_obj.is_enabled.clear_cache(snapshot_obj)
+        return res
@@ -19,6 +19,7 @@
 #
 ##############################################################################
 
+from openerp import tools
 from openerp.osv import orm, fields
 import openerp.addons.decimal_precision as dp
 
@@ -26,68 +27,155 @@ import openerp.addons.decimal_precision as dp
 class ProductProduct(orm.Model):
     _inherit = 'product.product'
 
+    @tools.ormcache(skiparg=2)
+    def _get_shop_warehouse(self, cr, uid, shop_id):
+        """ Return the warehouse of a shop.
+
+        The result is cached by user until a shop is modified, which is
+        done by the module ``crm_rma_stock_location_sale``.
+        """
+        shop = self.pool['sale.shop'].read(cr, uid, shop_id,
+                                           ['warehouse_id'],
+                                           load='_classic_write')
+        return shop['warehouse_id']
+
+    def _get_rma_locations(self, cr, uid, context=None):
+        """ Return the RMA locations of the warehouse of the context, or of
+        all the warehouses when there is none.
+
+        See ``stock.warehouse._get_rma_locations`` for the result.
+        """
+        if context is None:
+            context = {}
+        warehouse_id = context.get('warehouse_id')
+        # no dependency on 'sale', the same oddness is done in
+        # 'stock' so I kept it here
+        if context.get('shop') and self.pool.get('sale.shop'):
+            warehouse_id = self._get_shop_warehouse(cr, uid, context['shop'])
+        warehouse_obj = self.pool['stock.warehouse']
+        return warehouse_obj._get_rma_locations(cr, uid, warehouse_id or None)
+
+    def _rma_snapshot_available(self, cr, uid, ids, field_names,
+                                context=None):
+        """ Read the RMA quantities from the snapshot """
+        if context is None:
+            context = {}
+        snapshot_obj = self.pool['stock.rma.snapshot']
+        res = {}
+        for id in ids:
+            res[id] = {}.fromkeys(field_names, 0.0)
+        warehouse_ids, __ = self._get_rma_locations(cr, uid, context=context)
+        if not warehouse_ids:
+            return res
+        quantities = snapshot_obj.get_quantities(
+            cr, uid, ids, warehouse_ids, context=context)
+        if not quantities:
+            return res
+        to_uom = None
+        if context.get('uom'):
+            uom_obj = self.pool['product.uom']
+            to_uom = uom_obj.browse(cr, uid, context['uom'], context=context)
+            products = self.browse(cr, uid, quantities.keys(),
+                                   context=context)
+            product_uoms = dict((product.id, product.uom_id)
+                                for product in products)
+        for product_id, (qty, virtual) in quantities.iteritems():
+            if to_uom is not None:
+                from_uom = product_uoms[product_id]
+                qty = uom_obj._compute_qty_obj(cr, uid, from_uom, qty,
+                                               to_uom, context=context)
+                virtual = uom_obj._compute_qty_obj(cr, uid, from_uom, virtual,
+                                                   to_uom, context=context)
+            values = res[product_id]
+            if 'rma_qty_available' in values:
+                values['rma_qty_available'] = qty
+            if 'rma_virtual_available' in values:
+                values['rma_virtual_available'] = virtual
+        return res
+
     def _rma_product_available(self, cr, uid, ids, field_names=None, arg=False,
                                context=None):
         """ Finds the incoming and outgoing quantity of product for the RMA
         locations.
+
+        Both quantities are computed together with one query on the moves
+        entering or leaving the RMA locations (including their children).
+        The quantity on hand counts the done moves, the forecasted quantity
+        the confirmed, waiting, assigned and done moves.  As in
+        ``get_product_available``, the ``uom``, ``from_date``, ``to_date``
+        and ``prodlot_id`` keys of the context are supported.
+
+        When the RMA snapshot is enabled, the quantities are read from it,
+        unless the context restricts the moves by date or lot.
         """
         if field_names is None:
             field_names = []
         if context is None:
             context = {}
-        warehouse_obj = self.pool['stock.warehouse']
         res = {}
         for id in ids:
             res[id] = {}.fromkeys(field_names, 0.0)
+        if not ids:
+            return res
+        snapshot_obj = self.pool['stock.rma.snapshot']
+        if (snapshot_obj.is_enabled(cr, uid) and
+                not context.get('rma_snapshot_disabled') and
+                not any(context.get(key) for key in
+                        ('from_date', 'to_date', 'prodlot_id'))):
+            return self._rma_snapshot_available(cr, uid, ids, field_names,
+                                                context=context)
+        __, location_ids = self._get_rma_locations(cr, uid, context=context)
+        if not location_ids:
+            return res
 
-        for field in field_names:
-            ctx = context.copy()
-
-            warehouse_id = ctx.get('warehouse_id')
-            # no dependency on 'sale', the same oddness is done in
-            # 'stock' so I kept it here
-            if ctx.get('shop') and self.pool.get('sale.shop'):
-                shop_obj = self.pool['sale.shop']
-                shop_id = ctx['shop']
-                warehouse = shop_obj.read(cr, uid, shop_id,
-                                          ['warehouse_id'],
-                                          context=ctx)
-                warehouse_id = warehouse['warehouse_id'][0]
-
-            if warehouse_id:
-                rma_id = warehouse_obj.read(cr, uid,
-                                            warehouse_id,
-                                            ['lot_rma_id'],
-                                            context=ctx)['lot_rma_id'][0]
-                if rma_id:
-                    ctx['location'] = rma_id
-            else:
-                location_ids = set()
-                wids = warehouse_obj.search(cr, uid, [], context=context)
-                if not wids:
-                    return res
-                for wh in warehouse_obj.browse(cr, uid, wids, context=context):
-                    if wh.lot_rma_id:
-                        location_ids.add(wh.lot_rma_id.id)
-                if not location_ids:
-                    return res
-                ctx['location'] = list(location_ids)
+        where = []
+        params = [location_ids, tuple(ids), location_ids, location_ids]
+        if context.get('from_date'):
+            where.append('AND m.date >= %s')
+            params.append(context['from_date'])
+        if context.get('to_date'):
+            where.append('AND m.date <= %s')
+            params.append(context['to_date'])
+        if context.get('prodlot_id'):
+            where.append('AND m.prodlot_id = %s')
+            params.append(context['prodlot_id'])
+        cr.execute("""
+            SELECT m.product_id, m.product_uom, m.state = 'done',
+                   SUM(CASE WHEN m.location_dest_id IN %%s
+                            THEN m.product_qty
+                            ELSE -m.product_qty END)
+            FROM stock_move m
+            WHERE m.product_id IN %%s
+              AND m.state IN ('confirmed', 'waiting', 'assigned', 'done')
+              AND (m.location_id IN %%s) <> (m.location_dest_id IN %%s)
+              %s
+            GROUP BY m.product_id, m.product_uom, m.state = 'done'
+            """ % ' '.join(where), params)
+        results = cr.fetchall()
+        if not results:
+            return res
 
-            ctx['compute_child'] = True
-            compute = {
-                'rma_qty_available': {
-                    'states': ('done', ),
-                    'what': ('in', 'out')
-                },
-                'rma_virtual_available': {
-                    'states': ('confirmed', 'waiting', 'assigned', 'done'),
-                    'what': ('in', 'out')
-                }
-            }
-            ctx.update(compute[field])
-            stock = self.get_product_available(cr, uid, ids, context=ctx)
-            for id in ids:
-                res[id][field] = stock.get(id, 0.0)
+        uom_obj = self.pool['product.uom']
+        products = self.read(cr, uid, ids, ['uom_id'], context=context,
+                             load='_classic_write')
+        product2uom = dict((product['id'], product['uom_id'])
+                           for product in products)
+        uom_ids = set(product2uom.itervalues())
+        uom_ids.update(row[1] for row in results)
+        if context.get('uom'):
+            uom_ids.add(context['uom'])
+        uoms = dict((uom.id, uom) for uom
+                    in uom_obj.browse(cr, uid, list(uom_ids),
+                                      context=context))
+        for product_id, uom_id, done, amount in results:
+            to_uom = uoms[context.get('uom') or product2uom[product_id]]
+            amount = uom_obj._compute_qty_obj(cr, uid, uoms[uom_id], amount,
+                                              to_uom, context=context)
+            values = res[product_id]
+            if done and 'rma_qty_available' in values:
+                values['rma_qty_available'] += amount
+            if 'rma_virtual_available' in values:
+                values['rma_virtual_available'] += amount
         return res
 
     _columns = {
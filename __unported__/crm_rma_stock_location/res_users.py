@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Author: Guewen Baconnier
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp.osv import orm
+
+
+class ResUsers(orm.Model):
+    _inherit = 'res.users'
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(ResUsers, self).write(cr, uid, ids, vals,
+                                          context=context)
+        # the RMA locations are cached by user and the warehouses of a
+        # user depend on its company
+        if 'company_id' in vals or 'company_ids' in vals:
+            warehouse_obj = self.pool['stock.warehouse']
+            warehouse_obj._get_rma_locations.clear_cache(warehouse_obj)
+        return res
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Author: Guewen Baconnier
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp.osv import orm
+
+
+class StockLocation(orm.Model):
+    _inherit = 'stock.location'
+
+    def _clear_rma_locations_cache(self, cr, uid, context=None):
+        warehouse_obj = self.pool['stock.warehouse']
+        warehouse_obj._get_rma_locations.clear_cache(warehouse_obj)
+
+    def create(self, cr, uid, vals, context=None):
+        location_id = super(StockLocation, self).create(cr, uid, vals,
+                                                        context=context)
+        # the new location may be a child of a RMA location
+        self._clear_rma_locations_cache(cr, uid, context=context)
+        return location_id
+
+    def _get_rma_warehouses(self, cr, uid, ids, context=None):
+        """ Return the ids of the warehouses having the locations in the
+        children of their RMA location """
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        if not ids:
+            return set()
+        cr.execute("SELECT DISTINCT w.id "
+                   "FROM stock_location loc "
+                   "JOIN stock_location rma "
+                   "  ON loc.parent_left > rma.parent_left "
+                   " AND loc.parent_left < rma.parent_right "
+                   "JOIN stock_warehouse w ON w.lot_rma_id = rma.id "
+                   "WHERE loc.id IN %s",
+                   (tuple(ids),))
+        return set(row[0] for row in cr.fetchall())
+
+    def write(self, cr, uid, ids, vals, context=None):
+        if 'location_id' in vals:
+            warehouse_ids = self._get_rma_warehouses(cr, uid, ids,
+                                                     context=context)
+        res = super(StockLocation, self).write(cr, uid, ids, vals,
+                                               context=context)
+        if 'location_id' in vals:
+            # the locations leave or enter the RMA locations of these
+            # warehouses
+            warehouse_ids |= self._get_rma_warehouses(cr, uid, ids,
+                                                      context=context)
+            if warehouse_ids:
+                self._clear_rma_locations_cache(cr, uid, context=context)
+                snapshot_obj = self.pool['stock.rma.snapshot']
+                if snapshot_obj.is_enabled(cr, uid):
+                    snapshot_obj.rebuild(cr, uid, list(warehouse_ids),
+                                         verify=False, context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(StockLocation, self).unlink(cr, uid, ids,
+                                                context=context)
+        self._clear_rma_locations_cache(cr, uid, context=context)
+        return res
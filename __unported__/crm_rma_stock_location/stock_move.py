@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Author: Guewen Baconnier
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp.osv import orm
+
+from .stock_rma_snapshot import SNAPSHOT_MOVE_FIELDS
+
+
+class StockMove(orm.Model):
+    """ Keep the RMA snapshot up to date with the moves """
+    _inherit = 'stock.move'
+
+    def create(self, cr, uid, vals, context=None):
+        move_id = super(StockMove, self).create(cr, uid, vals,
+                                                context=context)
+        snapshot_obj = self.pool['stock.rma.snapshot']
+        if snapshot_obj.is_enabled(cr, uid):
+            after = snapshot_obj._compute_quantities(
+                cr, uid, move_ids=[move_id], context=context)
+            snapshot_obj._apply_deltas(cr, uid, {}, after, context=context)
+        return move_id
+
+    def write(self, cr, uid, ids, vals, context=None):
+        snapshot_obj = self.pool['stock.rma.snapshot']
+        if not (snapshot_obj.is_enabled(cr, uid) and
+                set(vals).intersection(SNAPSHOT_MOVE_FIELDS)):
+            return super(StockMove, self).write(cr, uid, ids, vals,
+                                                context=context)
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        before = snapshot_obj._compute_quantities(cr, uid, move_ids=ids,
+                                                  context=context)
+        res = super(StockMove, self).write(cr, uid, ids, vals,
+                                           context=context)
+        after = snapshot_obj._compute_quantities(cr, uid, move_ids=ids,
+                                                 context=context)
+        snapshot_obj._apply_deltas(cr, uid, before, after, context=context)
+        return res
+
+    def check_assign(self, cr, uid, ids, context=None):
+        """ The location and the quantity of the reserved moves are
+        changed in SQL; the state written afterwards does not change
+        their RMA quantities, so the difference over the whole call is
+        the one of the SQL change.  The moves split from them are created
+        with ``copy``, which adds their quantities.
+        """
+        snapshot_obj = self.pool['stock.rma.snapshot']
+        if not snapshot_obj.is_enabled(cr, uid):
+            return super(StockMove, self).check_assign(cr, uid, ids,
+                                                       context=context)
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        before = snapshot_obj._compute_quantities(cr, uid, move_ids=ids,
+                                                  context=context)
+        res = super(StockMove, self).check_assign(cr, uid, ids,
+                                                  context=context)
+        after = snapshot_obj._compute_quantities(cr, uid, move_ids=ids,
+                                                 context=context)
+        snapshot_obj._apply_deltas(cr, uid, before, after, context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        snapshot_obj = self.pool['stock.rma.snapshot']
+        if not snapshot_obj.is_enabled(cr, uid):
+            return super(StockMove, self).unlink(cr, uid, ids,
+                                                 context=context)
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        before = snapshot_obj._compute_quantities(cr, uid, move_ids=ids,
+                                                  context=context)
+        res = super(StockMove, self).unlink(cr, uid, ids, context=context)
+        snapshot_obj._apply_deltas(cr, uid, before, {}, context=context)
+        return res
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Author: Guewen Baconnier
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+
+from openerp import SUPERUSER_ID, tools
+from openerp.osv import orm, fields
+from openerp.tools.float_utils import float_compare
+import openerp.addons.decimal_precision as dp
+
+_logger = logging.getLogger(__name__)
+
+# when the parameter is set to '1', the RMA quantities of the products are
+# read from the snapshot, which is maintained by the moves
+SNAPSHOT_PARAMETER = 'crm_rma_stock_location.snapshot'
+
+# fields of the moves used to compute the snapshot
+SNAPSHOT_MOVE_FIELDS = ('product_id', 'product_qty', 'product_uom',
+                        'location_id', 'location_dest_id', 'state')
+
+
+class StockRmaSnapshot(orm.Model):
+    """ RMA quantities of the products by warehouse
+
+    The quantity on hand and the forecasted quantity of each product in the
+    RMA location (with its children) of each warehouse, in the unit of
+    measure of the product.
+
+    When the snapshot is enabled with the ``crm_rma_stock_location.snapshot``
+    parameter, it is updated for each change of the moves and the RMA
+    quantities of the products are read from it.  It must be built with
+    ``rebuild`` when it is enabled.
+
+    A change of the moves only inserts the differences of quantities, the
+    rows of a product and a warehouse are summed when they are read: the
+    concurrent transactions neither lock the same rows nor conflict when
+    they add the first quantities of a product.  ``rebuild`` merges them
+    again in one row by product and warehouse.
+    """
+    _name = 'stock.rma.snapshot'
+    _description = 'RMA Stock Snapshot'
+    _log_access = False
+
+    _columns = {
+        'product_id': fields.many2one('product.product', 'Product',
+                                      required=True, select=True,
+                                      ondelete='cascade'),
+        'warehouse_id': fields.many2one('stock.warehouse', 'Warehouse',
+                                        required=True, select=True,
+                                        ondelete='cascade'),
+        'qty_available': fields.float(
+            'RMA Quantity On Hand',
+            digits_compute=dp.get_precision('Product Unit of Measure')),
+        'virtual_available': fields.float(
+            'RMA Forecasted Quantity',
+            digits_compute=dp.get_precision('Product Unit of Measure')),
+    }
+
+    @tools.ormcache(skiparg=3)
+    def is_enabled(self, cr, uid):
+        param_obj = self.pool['ir.config_parameter']
+        value = param_obj.get_param(cr, SUPERUSER_ID, SNAPSHOT_PARAMETER)
+        return value == '1'
+
+    def _compute_quantities(self, cr, uid, move_ids=None, warehouse_ids=None,
+                            context=None):
+        """ Compute the RMA quantities of the moves, or of all the moves
+        when ``move_ids`` is None, for the warehouses, or all the warehouses
+        when ``warehouse_ids`` is None.
+
+        Return a dict ``{(product_id, warehouse_id): [qty, virtual]}``.
+        """
+        warehouse_where = ''
+        move_where = ''
+        params = []
+        if warehouse_ids is not None:
+            if not warehouse_ids:
+                return {}
+            warehouse_where = 'AND w.id IN %s'
+            params.append(tuple(warehouse_ids))
+        if move_ids is not None:
+            if not move_ids:
+                return {}
+            move_where = 'AND m.id IN %s'
+            params.append(tuple(move_ids))
+        # only the moves entering or leaving a RMA location are read, then
+        # they are joined to the warehouses of their source and destination
+        cr.execute("""
+            WITH rma_location AS (
+                SELECT w.id AS warehouse_id, child.id AS location_id
+                FROM stock_warehouse w
+                JOIN stock_location parent ON parent.id = w.lot_rma_id
+                JOIN stock_location child
+                  ON child.parent_left >= parent.parent_left
+                 AND child.parent_left < parent.parent_right
+                WHERE w.lot_rma_id IS NOT NULL
+                  %s
+            ), rma_move AS (
+                SELECT m.id, m.product_id, m.product_qty, m.product_uom,
+                       m.location_id, m.location_dest_id, m.state
+                FROM stock_move m
+                WHERE m.state IN ('confirmed', 'waiting', 'assigned', 'done')
+                  AND (m.location_id IN (SELECT location_id
+                                         FROM rma_location)
+                       OR m.location_dest_id IN (SELECT location_id
+                                                 FROM rma_location))
+                  %s
+            )
+            SELECT product_id, warehouse_id,
+                   SUM(CASE WHEN state = 'done' THEN qty ELSE 0 END),
+                   SUM(qty)
+            FROM (
+                SELECT m.product_id, loc.warehouse_id, m.state,
+                       m.product_qty / move_uom.factor * product_uom.factor
+                       * CASE WHEN dest.location_id IS NOT NULL THEN 1
+                              ELSE -1 END AS qty
+                FROM rma_move m
+                JOIN rma_location loc
+                  ON loc.location_id IN (m.location_id, m.location_dest_id)
+                JOIN product_product p ON p.id = m.product_id
+                JOIN product_template t ON t.id = p.product_tmpl_id
+                JOIN product_uom move_uom ON move_uom.id = m.product_uom
+                JOIN product_uom product_uom ON product_uom.id = t.uom_id
+                LEFT JOIN rma_location src
+                       ON src.warehouse_id = loc.warehouse_id
+                      AND src.location_id = m.location_id
+                LEFT JOIN rma_location dest
+                       ON dest.warehouse_id = loc.warehouse_id
+                      AND dest.location_id = m.location_dest_id
+                WHERE (src.location_id IS NULL) <> (dest.location_id IS NULL)
+            ) moves
+            GROUP BY product_id, warehouse_id
+            """ % (warehouse_where, move_where), params)
+        return dict(((product_id, warehouse_id), [qty, virtual])
+                    for product_id, warehouse_id, qty, virtual
+                    in cr.fetchall())
+
+    def _apply_deltas(self, cr, uid, before, after, context=None):
+        """ Add to the snapshot the difference between the quantities
+        computed before and after a change of moves """
+        deltas = []
+        for key in set(before) | set(after):
+            qty_before, virtual_before = before.get(key, (0.0, 0.0))
+            qty_after, virtual_after = after.get(key, (0.0, 0.0))
+            qty = qty_after - qty_before
+            virtual = virtual_after - virtual_before
+            if qty or virtual:
+                deltas.append(key + (qty, virtual))
+        if not deltas:
+            return
+        values = ', '.join(['(%s, %s, %s, %s)'] * len(deltas))
+        params = [param for delta in deltas for param in delta]
+        cr.execute("INSERT INTO stock_rma_snapshot "
+                   "(product_id, warehouse_id, "
+                   " qty_available, virtual_available) "
+                   "VALUES %s" % values, params)
+
+    def get_quantities(self, cr, uid, product_ids, warehouse_ids,
+                       context=None):
+        """ Return the RMA quantities of the products in the warehouses
+        as a dict ``{product_id: (qty, virtual)}`` in the unit of measure
+        of the products """
+        if not (product_ids and warehouse_ids):
+            return {}
+        cr.execute("SELECT product_id, SUM(qty_available), "
+                   "       SUM(virtual_available) "
+                   "FROM stock_rma_snapshot "
+                   "WHERE product_id IN %s AND warehouse_id IN %s "
+                   "GROUP BY product_id",
+                   (tuple(product_ids), tuple(warehouse_ids)))
+        return dict((product_id, (qty, virtual))
+                    for product_id, qty, virtual in cr.fetchall())
+
+    def rebuild(self, cr, uid, warehouse_ids=None, verify=True,
+                context=None):
+        """ Build the snapshot again from the moves, for the warehouses or
+        all of them, and when ``verify`` is True, verify it against the
+        live computation of the RMA quantities of the products.
+
+        The differences between the previous snapshot and the new one and
+        between the new one and the live computation are logged.
+        Return the number of differences with the live computation.
+        """
+        if isinstance(warehouse_ids, (int, long)):
+            warehouse_ids = [warehouse_ids]
+        if warehouse_ids is None:
+            warehouse_ids = self.pool['stock.warehouse'].search(
+                cr, uid, [], context=context)
+        if not warehouse_ids:
+            return 0
+        precision = self.pool['decimal.precision'].precision_get(
+            cr, uid, 'Product Unit of Measure')
+        quantities = self._compute_quantities(cr, uid,
+                                              warehouse_ids=warehouse_ids,
+                                              context=context)
+        cr.execute("DELETE FROM stock_rma_snapshot "
+                   "WHERE warehouse_id IN %s "
+                   "RETURNING product_id, warehouse_id, "
+                   "          qty_available, virtual_available",
+                   (tuple(warehouse_ids),))
+        previous = {}
+        for product_id, warehouse_id, qty, virtual in cr.fetchall():
+            old = previous.setdefault((product_id, warehouse_id), [0.0, 0.0])
+            old[0] += qty
+            old[1] += virtual
+        drifts = 0
+        for key in set(previous) | set(quantities):
+            old = previous.get(key, (0.0, 0.0))
+            new = quantities.get(key, (0.0, 0.0))
+            if any(float_compare(o, n, precision_digits=precision)
+                   for o, n in zip(old, new)):
+                drifts += 1
+        if drifts:
+            _logger.warning('RMA snapshot: %d quantities were wrong and '
+                            'have been rebuilt', drifts)
+        self._apply_deltas(cr, uid, {}, quantities, context=context)
+        if not verify:
+            return 0
+        return self._verify(cr, uid, warehouse_ids, quantities,
+                            precision, context=context)
+
+    def _verify(self, cr, uid, warehouse_ids, quantities, precision,
+                context=None):
+        """ Compare the snapshot of the warehouses with the live
+        computation of the quantities of the products """
+        product_obj = self.pool['product.product']
+        differences = 0
+        for warehouse_id in warehouse_ids:
+            product_ids = list(set(product_id for product_id, wh_id
+                                   in quantities if wh_id == warehouse_id))
+            if not product_ids:
+                continue
+            ctx = dict(context or {},
+                       warehouse_id=warehouse_id,
+                       rma_snapshot_disabled=True)
+            live = product_obj._rma_product_available(
+                cr, uid, product_ids,
+                ['rma_qty_available', 'rma_virtual_available'],
+                context=ctx)
+            for product_id in product_ids:
+                qty, virtual = quantities[(product_id, warehouse_id)]
+                values = live[product_id]
+                if (float_compare(qty, values['rma_qty_available'],
+                                  precision_digits=precision) or
+                        float_compare(virtual,
+                                      values['rma_virtual_available'],
+                                      precision_digits=precision)):
+                    differences += 1
+                    _logger.warning(
+                        'RMA snapshot of the product %s in the warehouse '
+                        '%s: %s / %s, live computation: %s / %s',
+                        product_id, warehouse_id, qty, virtual,
+                        values['rma_qty_available'],
+                        values['rma_virtual_available'])
+        return differences
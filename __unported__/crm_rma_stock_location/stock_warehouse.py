@@ -19,6 +19,7 @@
 #
 ##############################################################################
 
+from openerp import tools
 from openerp.osv import orm, fields
 
 
@@ -28,3 +29,69 @@ class StockWarehouse(orm.Model):
     _columns = {
         'lot_rma_id': fields.many2one('stock.location', 'Location RMA'),
     }
+
+    @tools.ormcache(skiparg=2)
+    def _get_rma_locations(self, cr, uid, warehouse_id):
+        """ Return the RMA locations of a warehouse, or of all the
+        warehouses of the user when ``warehouse_id`` is None.
+
+        Return a tuple ``(warehouse_ids, location_ids)``: the warehouses
+        having a RMA location, only one for each RMA location, and the RMA
+        locations with their children.
+
+        The result is cached by user until a warehouse, the hierarchy of
+        the locations or the company of a user is modified.
+        """
+        if warehouse_id:
+            warehouse_ids = [warehouse_id]
+        else:
+            warehouse_ids = self.search(cr, uid, [])
+        if not warehouse_ids:
+            return (), ()
+        cr.execute("SELECT DISTINCT ON (lot_rma_id) id, lot_rma_id "
+                   "FROM stock_warehouse "
+                   "WHERE id IN %s AND lot_rma_id IS NOT NULL "
+                   "ORDER BY lot_rma_id, id",
+                   (tuple(warehouse_ids),))
+        rows = cr.fetchall()
+        if not rows:
+            return (), ()
+        cr.execute("SELECT DISTINCT child.id "
+                   "FROM stock_location parent "
+                   "JOIN stock_location child "
+                   "  ON child.parent_left >= parent.parent_left "
+                   " AND child.parent_left < parent.parent_right "
+                   "WHERE parent.id IN %s "
+                   "ORDER BY child.id",
+                   (tuple(row[1] for row in rows),))
+        location_ids = tuple(row[0] for row in cr.fetchall())
+        return tuple(sorted(row[0] for row in rows)), location_ids
+
+    def create(self, cr, uid, vals, context=None):
+        warehouse_id = super(StockWarehouse, self).create(cr, uid, vals,
+                                                          context=context)
+        self._get_rma_locations.clear_cache(self)
+        snapshot_obj = self.pool['stock.rma.snapshot']
+        if vals.get('lot_rma_id') and snapshot_obj.is_enabled(cr, uid):
+            snapshot_obj.rebuild(cr, uid, [warehouse_id], verify=False,
+                                 context=context)
+        return warehouse_id
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(StockWarehouse, self).write(cr, uid, ids, vals,
+                                                context=context)
+        if 'lot_rma_id' in vals:
+            self._get_rma_locations.clear_cache(self)
+            snapshot_obj = self.pool['stock.rma.snapshot']
+            if snapshot_obj.is_enabled(cr, uid):
+                if isinstance(ids, (int, long)):
+                    ids = [ids]
+                snapshot_obj.rebuild(cr, uid, ids, verify=False,
+                                     context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(StockWarehouse, self).unlink(cr, uid, ids,
+                                                 context=context)
+        self._get_rma_locations.clear_cache(self)
+        return res
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    Author: Guewen Baconnier
+#    Copyright 2014 Camptocamp SA
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from openerp.osv import orm
+
+
+class SaleShop(orm.Model):
+    _inherit = 'sale.shop'
+
+    def _clear_shop_warehouse_cache(self, cr, uid, context=None):
+        product_obj = self.pool['product.product']
+        product_obj._get_shop_warehouse.clear_cache(product_obj)
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(SaleShop, self).write(cr, uid, ids, vals,
+                                          context=context)
+        if 'warehouse_id' in vals:
+            self._clear_shop_warehouse_cache(cr, uid, context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(SaleShop, self).unlink(cr, uid, ids, context=context)
+        self._clear_shop_warehouse_cache(cr, uid, context=context)
+        return res
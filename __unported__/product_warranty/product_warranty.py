@@ -20,8 +20,13 @@
 #along with this program.  If not, see <http://www.gnu.org/licenses/>.  #
 #########################################################################
 
+import logging
+
+from openerp import SUPERUSER_ID, tools
 from openerp.osv import orm, fields
 
+_logger = logging.getLogger(__name__)
+
 
 class return_instruction(orm.Model):
     _name = "return.instruction"
@@ -37,6 +42,61 @@ class return_instruction(orm.Model):
                  "supplier infos. Be careful to have only one default"),
     }
 
+    def init(self, cr):
+        """ Only one instruction can be the default one """
+        cr.execute("SELECT 1 FROM pg_indexes "
+                   "WHERE indexname = 'return_instruction_is_default_uniq'")
+        if cr.fetchone():
+            return
+        cr.execute("SELECT count(*) FROM return_instruction WHERE is_default")
+        if cr.fetchone()[0] > 1:
+            _logger.warning('Several return instructions are the default '
+                            'one, the unique index on the default return '
+                            'instruction cannot be created.')
+            return
+        cr.execute("CREATE UNIQUE INDEX return_instruction_is_default_uniq "
+                   "ON return_instruction (is_default) WHERE is_default")
+
+    def _check_is_default(self, cr, uid, ids, context=None):
+        default_ids = self.search(cr, uid, [('is_default', '=', True)],
+                                  context=context)
+        return len(default_ids) <= 1
+
+    _constraints = [
+        (_check_is_default,
+         'Only one return instruction can be the default one.',
+         ['is_default']),
+    ]
+
+    @tools.ormcache(skiparg=3)
+    def _get_default_instruction_id(self, cr, uid):
+        """ Return the ID of the default instruction, cached until an
+        instruction is modified """
+        instruction_ids = self.search(cr, SUPERUSER_ID,
+                                      [('is_default', '=', True)],
+                                      limit=1)
+        if instruction_ids:
+            return instruction_ids[0]
+        return False
+
+    def create(self, cr, uid, vals, context=None):
+        res = super(return_instruction, self).create(cr, uid, vals,
+                                                     context=context)
+        self._get_default_instruction_id.clear_cache(self)
+        return res
+
+    def write(self, cr, uid, ids, vals, context=None):
+        res = super(return_instruction, self).write(cr, uid, ids, vals,
+                                                    context=context)
+        self._get_default_instruction_id.clear_cache(self)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        res = super(return_instruction, self).unlink(cr, uid, ids,
+                                                     context=context)
+        self._get_default_instruction_id.clear_cache(self)
+        return res
+
 
 class product_supplierinfo(orm.Model):
     _inherit = "product.supplierinfo"
@@ -49,14 +109,9 @@ class product_supplierinfo(orm.Model):
         return result
 
     def _get_default_instructions(self, cr, uid, context=None):
-        """ Get selected lines to add to exchange """
+        """ Get the default return instruction """
         instr_obj = self.pool.get('return.instruction')
-        instruction_ids = instr_obj.search(cr, uid,
-                                           [('is_default', '=', 'FALSE')],
-                                           context=context)
-        if instruction_ids:
-            return instruction_ids[0]
-        return False
+        return instr_obj._get_default_instruction_id(cr, uid)
 
     def _get_warranty_return_address(self, cr, uid, ids, field_names, arg, context=None):
         """ Method to return the partner delivery address or if none, the default address
@@ -83,6 +138,15 @@ class product_supplierinfo(orm.Model):
                 result[supplier_info.id] = partner_id
         return result
 
+    def _get_supplierinfo_from_company(self, cr, uid, ids, context=None):
+        """ Store trigger of the return address: ``self`` is
+        ``res.company``.  All the supplier infos of the company are
+        recomputed, whatever the record rules of the user. """
+        supplierinfo_obj = self.pool.get('product.supplierinfo')
+        return supplierinfo_obj.search(cr, SUPERUSER_ID,
+                                       [('company_id', 'in', ids)],
+                                       context=context)
+
     _columns = {
         "warranty_duration": fields.float(
             'Period',
@@ -108,6 +172,18 @@ class product_supplierinfo(orm.Model):
         'warranty_return_address': fields.function(
             _get_warranty_return_address,
             type='many2one', relation='res.partner', string="Return address",
+            store={
+                'product.supplierinfo': (
+                    lambda self, cr, uid, ids, c=None: ids,
+                    ['warranty_return_partner', 'name', 'company_id',
+                     'warranty_return_other_address_id'],
+                    10),
+                'res.company': (
+                    _get_supplierinfo_from_company,
+                    ['crm_return_address_id', 'partner_id'],
+                    10),
+            },
+            select=True,
             help="Where the goods should be returned  "
                  "(computed field based on other infos.)"),
         "warranty_return_other_address_id": fields.many2one(